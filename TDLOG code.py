@@ -37,7 +37,7 @@ cash_flow_statement = cash_flow_statement.apply(pd.to_numeric, errors='coerce')
 cash_flow_statement.iloc[:,4:].head()
 
 ttm_cash_flow_statement = q_cash_flow_statement.sum() # sum up last 4 quarters to get TTM cash flow
-cash_flow_statement = cash_flow_statement[::-1].append(ttm_cash_flow_statement.rename('TTM')).drop(['netIncome'], axis=1)
+cash_flow_statement = pd.concat([cash_flow_statement[::-1], ttm_cash_flow_statement.rename('TTM').to_frame().T]).drop(['netIncome'], axis=1)
 final_cash_flow_statement = cash_flow_statement[::-1] # reverse list to show most recent ones first
 final_cash_flow_statement.iloc[:,4:].head()
 
@@ -1,36 +1,111 @@
-from flask import Flask, render_template, request, url_for, flash, redirect
-import numpy as np
-import pandas as pd
-import yfinance as yf
+from flask import Flask, render_template as flask_render_template, request, session, url_for, flash, redirect, jsonify, Response, stream_template, stream_with_context, abort
+import os
 from os import removedirs
+import time
+import math
+import json
+import queue
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import make_transient_to_detached
 from flask_login import UserMixin, login_user, LoginManager, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import InputRequired, Length, length, ValidationError
 from flask_bcrypt import Bcrypt
-import financials as fin
+#the modules using numpy, pandas, yfinance or the parsers are imported by the functions which need them,
+#so that the workers start without them and serve the pages which do not need them first
+try:
+    import fcntl
+except ImportError:
+    # Windows: only the development server, in one process
+    fcntl = None
+
+import cache
+import http_cache
+import metrics
 
 app = Flask(__name__)
+#cost factor of the password hashes (2**rounds iterations of bcrypt)
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('TDLOG_BCRYPT_ROUNDS', 12))
+#the users and their favorites, in the folder of the local data (TDLOG_DATA), created by: flask --app app init-db
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(os.environ.get('TDLOG_DATA', app.root_path), 'database.sql')
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 sql=SQLAlchemy(app)
 bcrypt=Bcrypt(app)
-app.config['SQLALCHEMY_DATABASE_URL']='sqlite:///database.sql'
 app.secret_key = "tdlog"
+#maximum number of points of the price graph (the longer intervals are downsampled), price_history.MAX_POINTS if None
+app.config['CHART_POINTS'] = None
+app.after_request(http_cache.compress)
+#adds the Server-Timing header (duration of each stage of the request) to the responses
+app.config['SERVER_TIMING'] = bool(os.environ.get('TDLOG_SERVER_TIMING'))
+#warms the data of the favorited and most viewed tickers in the background (TDLOG_PREFETCH=0 to disable it)
+app.config['PREFETCH'] = os.environ.get('TDLOG_PREFETCH', '1') != '0'
+#lock held by the process which prefetches, one per host
+PREFETCH_LOCK = os.path.join(os.environ.get('TDLOG_DATA', app.root_path), 'prefetch.lock')
+
+#answers from the synthetic fixtures instead of Yahoo Finance and Finviz (tests and benchmarks)
+if os.environ.get('TDLOG_OFFLINE'):
+    import offline
+    offline.install(float(os.environ.get('TDLOG_OFFLINE_LATENCY', offline.LATENCY)))
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = "login"
 
+#seconds during which a user loaded from the database is reused by the next requests
+USER_TTL = 30
+user_cache = cache.TTLCache(ttl={'user': USER_TTL}, flight=cache.SingleFlight())
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    '''
+    Returns the user of the session, from the database at most every USER_TTL seconds: the columns
+    are cached and attached to the session of the request without a query
+    '''
+    columns = user_cache.get('user', int(user_id), lambda: user_columns(int(user_id)))
+    if columns is None:
+        return None
+    user = User(**columns)
+    make_transient_to_detached(user)
+    return sql.session.merge(user, load=False)
+
+def user_columns(user_id):
+    user = User.query.get(user_id)
+    if user is None:
+        return None
+    return {column.name: getattr(user, column.name) for column in User.__table__.columns}
 
 class User(sql.Model,UserMixin): 
    id=sql.Column(sql.Integer,primary_key=True)
    username = sql.Column(sql.String(100),nullable=False, unique=True)
    email_adress = sql.Column(sql.String(80),nullable=False)
    password = sql.Column(sql.String(80),nullable=False)
-sql.create_all()
+   favorites = sql.relationship('Favorite', backref='user', lazy=True)
+
+class Favorite(sql.Model):
+   id=sql.Column(sql.Integer,primary_key=True)
+   user_id = sql.Column(sql.Integer,sql.ForeignKey('user.id'),nullable=False)
+   ticker = sql.Column(sql.String(20),nullable=False)
+   __table_args__ = (sql.UniqueConstraint('user_id', 'ticker'),)
+
+def init_db():
+    '''
+    Creates the tables of the users and their favorites which do not exist yet
+    '''
+    with app.app_context():
+        sql.create_all()
+
+@app.cli.command('init-db')
+def init_db_command():
+    '''
+    Creates the database of the users: flask --app app init-db
+    '''
+    init_db()
+    print('Database created in ' + app.config['SQLALCHEMY_DATABASE_URI'])
 
 class RegisterForms(FlaskForm): 
     username = StringField(validators=[InputRequired(),Length(min=4, max=100)],render_kw={"placeholder": "Username"})
@@ -53,12 +128,115 @@ class LoginForms(FlaskForm):
     password = PasswordField(validators=[InputRequired(), Length(min=4, max=20)],render_kw={"placeholder": "Password"})
     submit = SubmitField("Login")
 
-messages = {'ticker_title': 'Ticker: ',
-             'ticker_content': '',
-             'name_title': 'Company: ',
-             'name_content': '',
-             'period':'5d' 
-             } 
+def render_template(template, **context):
+    '''
+    Renders a template like flask.render_template, timing the rendering
+    '''
+    with metrics.span('render'):
+        return flask_render_template(template, **context)
+
+@app.before_request
+def start_timing():
+    metrics.start_request()
+    request.start_time = time.perf_counter()
+
+@app.before_request
+def start_background_tasks():
+    # flask run, python app.py and each gunicorn worker: started at the first request
+    if app.config['PREFETCH'] and not app.testing:
+        start_prefetcher_once()
+
+@app.after_request
+def record_timing(response):
+    duration = time.perf_counter() - request.start_time
+    metrics.registry.observe('tdlog_request_seconds', duration, (('endpoint', request.endpoint), ))
+    if app.config['SERVER_TIMING']:
+        parts = [metrics.server_timing(), 'total;dur=%.1f' % (duration*1000)]
+        response.headers['Server-Timing'] = ', '.join(part for part in parts if part)
+    return response
+
+#bounded pool running the independent upstream calls of a page concurrently
+executor = ThreadPoolExecutor(max_workers=16)
+
+#maximum wait (in seconds) for each part of the ticker page
+FETCH_TIMEOUT = {'description': 5,
+                 'graphic': 5,
+                 'fairprice': 10
+                 }
+
+#bounded pool hashing the passwords: at login peaks bcrypt cannot use more than HASH_WORKERS cores
+HASH_WORKERS = int(os.environ.get('TDLOG_HASH_WORKERS', os.cpu_count() or 1))
+hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='bcrypt')
+
+def hash_password(password):
+    '''
+    Returns the bcrypt hash of a password, computed in the hashing pool
+    '''
+    with metrics.span('bcrypt'):
+        return hash_executor.submit(bcrypt.generate_password_hash, password).result()
+
+def check_password(pw_hash, password):
+    '''
+    Returns True if the password matches the bcrypt hash, checked in the hashing pool
+    '''
+    with metrics.span('bcrypt'):
+        return hash_executor.submit(bcrypt.check_password_hash, pw_hash, password).result()
+
+#seconds between two comments keeping the live price streams open when the price does not change
+LIVE_KEEPALIVE = 30
+
+#number of tickers proposed by the search boxes, and of companies of the undervalued ranking at most
+SEARCH_LIMIT = 10
+TOP_LIMIT = 100
+
+def known_ticker(view):
+    '''
+    Decorates a view taking a symbol: answers 404 for the symbols which are not tickers, or which neither
+    the valuation index, Finviz nor Yahoo Finance know
+    '''
+    @wraps(view)
+    def wrapper(symbol, **kwargs):
+        import valuation_index
+        if not valuation_index.is_valid(symbol):
+            abort(404)
+        return view(symbol, **kwargs)
+    return wrapper
+
+def search(ticker, template):
+    '''
+    Returns the redirection to the page of a searched ticker, or the search page again with a message when it is unknown
+    '''
+    import valuation_index
+    ticker = ticker.strip().upper()
+    if not ticker:
+        return render_template(template)
+    if not valuation_index.is_valid(ticker):
+        flash('Unknown ticker: %s' % ticker)
+        return render_template(template)
+    return redirect(url_for('page_ticker', symbol=ticker))
+
+def fan_out(calls):
+    '''
+    Runs independent calls concurrently and waits for each one at most its own timeout
+
+            Parameters:
+                    calls (dict): name -> (function, args, default value, timeout in seconds)
+
+            Returns:
+                    results (dict): name -> value returned by the function, or the default value if it failed or timed out
+    '''
+    start = time.monotonic()
+    #the calls run in a copy of the request context so that their spans are added to the request timings
+    futures = {name: executor.submit(contextvars.copy_context().run, f, *args) for name, (f, args, default, timeout) in calls.items()}
+    results = {}
+    for name, future in futures.items():
+        f, args, default, timeout = calls[name]
+        try:
+            results[name] = future.result(timeout=max(0, start + timeout - time.monotonic()))
+        except Exception as e:
+            print ('Could not get ' + name + ': ' + repr(e))
+            results[name] = default
+    return results
 
 def graphic(acao,interval="5d"):
     '''
@@ -71,9 +249,12 @@ def graphic(acao,interval="5d"):
             Returns:
                    list_graphic (list): a list containing the graphs values and labels
     '''
-    hist = acao.history(period=interval)['Close']
-    labels = list(np.array(hist.index, dtype='datetime64[D]').astype(str)) 
-    values=list(np.around(np.array(hist),decimals=2))
+    import numpy as np
+    import price_history
+    dates, closes = price_history.history.closes(acao, interval)
+    dates, closes = price_history.downsample(dates, closes, app.config['CHART_POINTS'] or price_history.MAX_POINTS)
+    labels = dates.astype(str).tolist()
+    values = np.around(closes.astype(float), decimals=2).tolist()
     list_graphic = [labels, values]
     return list_graphic
 
@@ -92,30 +273,92 @@ def description(acao):
     return list_description
 
 
-def fairprice(acao,ticker):
+def risk_model():
     '''
-    Calls the functions from the financials module and returns the fair value
+    Returns the model of the discount rate asked in the url or the form (?risk=table or ?risk=capm), financials.RISK_MODEL otherwise
+    '''
+    import financials as fin
+    model = request.values.get('risk')
+    return model if model in fin.RISK_MODELS else fin.RISK_MODEL
+
+def fairvalue_key(ticker, model=None):
+    '''
+    Returns the cache key of a fair value: the ticker for the default model of the discount rate
+    '''
+    import financials as fin
+    if model is None or model == fin.RISK_MODEL:
+        return ticker.upper()
+    return (ticker.upper(), model)
+
+def fairprice(acao,ticker,model=None):
+    '''
+    Returns the fair value, kept in the memory cache for an hour
 
             Parameters:
                     acao (ticker object): target company
                     ticker (str): the company ticker 
+                    model (str): model of the discount rate, 'table' or 'capm' (financials.RISK_MODEL by default)
 
             Returns:
                     value (float): the company's fair value
     '''
-    finviz=fin.get_finviz_data(ticker)
-    discount_rate=fin.discount_rate(finviz)
+    return cache.ticker_cache.get('fairvalue', fairvalue_key(ticker, model), lambda: compute_fairprice(acao,ticker,model))
+
+def compute_fairprice(acao,ticker,model=None):
+    '''
+    Calls the functions from the financials module and returns the fair value
+
+            Parameters:
+                    acao (ticker object): target company
+                    ticker (str): the company ticker 
+                    model (str): model of the discount rate
+
+            Returns:
+                    value (float): the company's fair value, nan if the beta is unknown
+    '''
+    import financials as fin
+    finviz=cache.get_finviz_data(ticker)
+    discount_rate=fin.discount_rate(finviz, model)
     if discount_rate is None:
-        return "nan"
+        return float('nan')
 
     EPS_growth_5Y=finviz['EPS next 5Y']
     EPS_growth_6Y_to_10Y=finviz['EPS next 5Y']/2
-    EPS_growth_11Y_to_20Y=0.04
+    EPS_growth_11Y_to_20Y=fin.EPS_GROWTH_11Y_TO_20Y
 
     value= fin.calculate_intrinsic_value(acao,EPS_growth_5Y, EPS_growth_6Y_to_10Y, EPS_growth_11Y_to_20Y, discount_rate,finviz)
 
     return value
 
+def scenarios(acao,ticker,model=None):
+    '''
+    Returns the fair value distribution over random scenarios and the growth x discount rate sensitivity grid
+
+            Parameters:
+                    acao (ticker object): target company
+                    ticker (str): the company ticker 
+                    model (str): model of the discount rate
+
+            Returns:
+                    scenario_values (dict): percentiles of the fair value and the sensitivity grid, or None if the metrics are missing
+    '''
+    import numpy as np
+    import financials as fin
+    finviz=cache.get_finviz_data(ticker)
+    discount_rate=fin.discount_rate(finviz, model)
+    if discount_rate is None:
+        return None
+
+    inputs = fin.statement_values(acao) + (finviz['Shs Outstand'], finviz['EPS next 5Y'], fin.EPS_GROWTH_11Y_TO_20Y, discount_rate)
+    if not np.isfinite(np.array(inputs, dtype=float)).all():
+        return None
+    percentiles = fin.fair_value_distribution(*inputs)
+    growths, rates, grid = fin.sensitivity_grid(*inputs)
+    return {'percentiles': list(zip(fin.PERCENTILES, np.around(percentiles, decimals=2))),
+            'growths': list(np.around(growths, decimals=2)),
+            'rates': list(rates),
+            'grid': np.around(grid, decimals=2).tolist()}
+
 @app.route("/", methods=("POST", "GET"))
 def home():
     '''
@@ -129,12 +372,7 @@ def home():
 	
 '''
     if request.method == 'POST':
-        ticker = request.form['user_input']
-        if not ticker:
-            return render_template("home.html")
-        else:
-            messages['ticker_content'] = ticker
-            return redirect(url_for('page_ticker'))
+        return search(request.form['user_input'], "home.html")
     else:
         return render_template("home.html")
 
@@ -156,7 +394,7 @@ def login():
         user = User.query.filter_by(username=form.username.data).first()
         if user : 
             #si tel est le cas l'utilisateur peut se connecter
-            if bcrypt.check_password_hash(user.password, form.password.data) :
+            if check_password(user.password, form.password.data) :
                 login_user(user)
                 return redirect (url_for('dashboard')) 
           #sinon on signifie à l'utilisateur qu'il n'a pas la bonne combinaison email/password
@@ -181,12 +419,7 @@ def dashboard():
 		render_template('dashboard.html')	
     '''
     if request.method == 'POST':
-        ticker = request.form['user_input']
-        if not ticker:
-            return render_template("dashboard.html")
-        else:
-            messages['ticker_content'] = ticker
-            return redirect(url_for('page_ticker'))
+        return search(request.form['user_input'], "dashboard.html")
     else:
         return render_template('dashboard.html')
 
@@ -222,7 +455,7 @@ def register():
     form = RegisterForms()
     if form.validate_on_submit() :
         #pour sécuriser la connexion on hash le mot de passe 
-        hashed_password = bcrypt.generate_password_hash(form.password.data)
+        hashed_password = hash_password(form.password.data)
         new_user = User(username = form.username.data, password = hashed_password, email_adress = form.email_adress.data)
         sql.session.add(new_user)
         sql.session.commit()
@@ -232,54 +465,235 @@ def register():
         return render_template("home.html")
 
 
-@app.route("/page_ticker", methods=("POST", "GET"))
-def page_ticker():
+@app.route("/ticker/<symbol>", methods=("POST", "GET"))
+@known_ticker
+@http_cache.conditional
+def page_ticker(symbol):
     '''
-	returns the page with the informations about the company whose ticker we searched, where we have the buttons to go back to home, login and do a new register, and also the search box to do a new search. If there is a user logged in, login is replaced by logout and we can also see a button to favorite the company in the profile. 
+	returns the page with the informations about the company whose ticker we searched, where we have the buttons to go back to home, login and do a new register, and also the search box to do a new search. If there is a user logged in, login is replaced by logout and we can also see a button to favorite the company in the profile. The ticker and the interval of the graph (?period=) are in the url, so that the page can be shared and cached.
 
 	Parameters: 
-		None
+		symbol (str): the company ticker
 
 	Returns:	
-		redirect(url_for('page_ticker')) 
+		render_template("page_ticker.html", ticker=..., period=..., shortName=..., summary=..., mode=..., risk=...)
 '''
-    acao=yf.Ticker(messages['ticker_content'])
-    list_description = description(acao)
-
+    period = request.args.get('period', '5d')
     if request.method == 'POST':
         if 'user_input' in request.form :
-            messages['ticker_content'] = request.form['user_input']
-            #resets selection to standard value, can keep preference if deleted
-            messages['period']='5d'
+            #a new search resets the interval to the standard value, an unknown ticker goes back to the home page
+            return search(request.form['user_input'], "home.html")
 
         if 'interval' in request.form :
-            interval=request.form["interval"]
-            messages['period']=interval
+            period=request.form["interval"]
 
-        return redirect(url_for('page_ticker')) 
+        return redirect(url_for('page_ticker', symbol=symbol, period=period)) 
         
             
     else:
-        list_graphic = graphic(acao,messages['period'])      
-        price=fairprice(acao,messages['ticker_content'])
-        if type(price)==str:
-            recommendation="nan"
-        else:
-            if list_graphic[1][-1]<price:
-                recommendation="Buy"
-            else:
-                recommendation="Sell"
+        import prefetch
+        prefetch.record_view(symbol)
+        acao=cache.CachedTicker(symbol)
+        #the downloads of the graph and of the valuation start now, the page fetches them from the api once displayed
+        executor.submit(graphic, acao, period)
+        executor.submit(lambda: acao.cashflow)
+        executor.submit(lambda: acao.balancesheet)
+        executor.submit(cache.get_finviz_data, symbol)
+        list_description = fan_out({'description': (description, (acao,), [symbol, ''], FETCH_TIMEOUT['description'])})['description']
         return render_template("page_ticker.html", 
-            messages=messages, 
-            labels=list_graphic[0], 
-            values=list_graphic[1], 
+            ticker=symbol, 
+            period=period, 
             shortName=list_description[0], 
             summary=list_description[1],
-            recommendation=recommendation,
-            price=price)
+            mode=request.args.get('mode'),
+            risk=risk_model(),
+            is_favorite=current_user.is_authenticated and Favorite.query.filter_by(user_id=current_user.id, ticker=symbol.upper()).first() is not None)
 
-    if request.method == 'GET':
-        return render_template("home.html")
+
+@app.route("/ticker/<symbol>/favorite", methods=["POST"])
+@login_required
+@known_ticker
+def favorite(symbol):
+    '''
+	adds the company to the favorites of the user logged in, or removes it if it is already there, and goes back to the ticker page
+
+	Parameters: 
+		symbol (str): the company ticker
+
+	Returns:	
+		redirect(url_for('page_ticker', symbol=symbol))
+'''
+    symbol = symbol.upper()
+    existing = Favorite.query.filter_by(user_id=current_user.id, ticker=symbol).first()
+    if existing:
+        sql.session.delete(existing)
+    else:
+        sql.session.add(Favorite(user_id=current_user.id, ticker=symbol))
+    sql.session.commit()
+    #the cached versions of the user's pages show the old favorites
+    session['page_version'] = session.get('page_version', 0) + 1
+    return redirect(url_for('page_ticker', symbol=symbol))
+
+
+def recommend(price, values):
+    '''
+    Compares the fair value with the last close
+
+            Parameters:
+                    price (float or str): the company's fair value ("nan" or nan if it could not be calculated)
+                    values (list): the closes of the graph
+
+            Returns:
+                    recommendation (str): "Buy", "Sell" or "nan"
+    '''
+    if type(price)==str or math.isnan(price) or not values:
+        return "nan"
+    if values[-1]<price:
+        return "Buy"
+    return "Sell"
+
+
+@app.route('/api/ticker/<symbol>/description')
+@known_ticker
+@http_cache.conditional
+def api_description(symbol):
+    '''
+	returns the name and the summary of a company as JSON
+
+	Parameters: 
+		symbol (str): the company ticker
+
+	Returns:
+		jsonify(ticker=..., shortName=..., summary=...)
+'''
+    acao=cache.CachedTicker(symbol)
+    list_description = fan_out({'description': (description, (acao,), [acao.ticker, ''], FETCH_TIMEOUT['description'])})['description']
+    return jsonify(ticker=acao.ticker, shortName=list_description[0], summary=list_description[1])
+
+
+@app.route('/api/ticker/<symbol>/series')
+@known_ticker
+@http_cache.conditional
+def api_series(symbol):
+    '''
+	returns the labels and values of the price graph of an interval (?period=5d, 1mo, 6mo or Max) as JSON
+
+	Parameters: 
+		symbol (str): the company ticker
+
+	Returns:
+		jsonify(ticker=..., period=..., labels=..., values=...)
+'''
+    acao=cache.CachedTicker(symbol)
+    period = request.args.get('period', '5d')
+    list_graphic = fan_out({'graphic': (graphic, (acao, period), [[], []], FETCH_TIMEOUT['graphic'])})['graphic']
+    return jsonify(ticker=acao.ticker, period=period, labels=list_graphic[0], values=list_graphic[1])
+
+
+@app.route('/api/ticker/<symbol>/valuation')
+@known_ticker
+@http_cache.conditional
+def api_valuation(symbol):
+    '''
+	returns the fair value, the last close and the recommendation as JSON, and with ?mode=scenarios the fair value percentiles and the sensitivity grid. The discount rate comes from the beta table, or from the CAPM with ?risk=capm
+
+	Parameters: 
+		symbol (str): the company ticker
+
+	Returns:
+		jsonify(ticker=..., price=..., last_close=..., recommendation=..., scenarios=...)
+'''
+    acao=cache.CachedTicker(symbol)
+    model=risk_model()
+    calls = {'graphic': (graphic, (acao, '5d'), [[], []], FETCH_TIMEOUT['graphic']),
+             'fairprice': (fairprice, (acao, acao.ticker, model), "nan", FETCH_TIMEOUT['fairprice'])}
+    if request.args.get('mode') == 'scenarios':
+        calls['scenarios'] = (scenarios, (acao, acao.ticker, model), None, FETCH_TIMEOUT['fairprice'])
+    results = fan_out(calls)
+    values = results['graphic'][1]
+    price = results['fairprice']
+    if type(price)!=str and math.isnan(price):
+        price = "nan"
+    return jsonify(ticker=acao.ticker,
+                   price=price,
+                   last_close=values[-1] if values else None,
+                   recommendation=recommend(price, values),
+                   scenarios=results.get('scenarios'))
+
+
+@app.route('/api/ticker/<symbol>/stream')
+@known_ticker
+def api_stream(symbol):
+    '''
+	streams the new prices of a company as Server-Sent Events, from the shared poller: each event has the date and the price of the last bar, the cached fair value and the recommendation (the DCF is not recomputed)
+
+	Parameters: 
+		symbol (str): the company ticker
+
+	Returns:
+		Response(events, mimetype='text/event-stream')
+'''
+    import live
+    symbol = symbol.upper()
+    key = fairvalue_key(symbol, risk_model())
+    def events():
+        #subscribed by the first iteration, so that a client gone before it leaves no subscription
+        updates = live.poller.subscribe(symbol)
+        try:
+            while True:
+                try:
+                    date, last_close = updates.get(timeout=LIVE_KEEPALIVE)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                price = cache.ticker_cache.peek('fairvalue', key)
+                #the fair values cached before the nan floats may still be the "nan" string
+                if price is None or type(price)==str or math.isnan(price):
+                    price = "nan"
+                yield 'data: %s\n\n' % json.dumps({'ticker': symbol, 'date': date, 'last_close': last_close,
+                                                    'price': price, 'recommendation': recommend(price, [last_close])})
+        finally:
+            live.poller.unsubscribe(symbol, updates)
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/api/search')
+def api_search():
+    '''
+	returns the known tickers starting with the text of the search box (?q=), with their name and last valuation, in JSON
+
+	Parameters: 
+		None
+
+	Returns:	
+		jsonify(rows)
+'''
+    import valuation_index
+    rows = valuation_index.index().complete(request.args.get('q', ''), SEARCH_LIMIT)
+    response = jsonify(rows)
+    response.headers['Cache-Control'] = 'public, max-age=%d' % http_cache.MAX_AGE
+    return response
+
+
+@app.route('/api/top-undervalued')
+def api_top_undervalued():
+    '''
+	returns the companies of the valuation index with the largest margin of safety (?n=, 20 by default), in JSON
+
+	Parameters: 
+		None
+
+	Returns:	
+		jsonify(rows)
+'''
+    import valuation_index
+    n = min(max(request.args.get('n', 20, type=int), 0), TOP_LIMIT)
+    response = jsonify(valuation_index.index().top(n))
+    response.headers['Cache-Control'] = 'public, max-age=%d' % http_cache.MAX_AGE
+    return response
 
 
 @app.route('/profile', methods=['GET', 'POST'])
@@ -292,10 +706,114 @@ def profile():
 		None
 
 	Returns: 
-		render_template("profile.html")	
+		render_template("profile.html", holdings=holdings): the table of the favorites with their last price, fair value, margin of safety and sparkline
+'''
+    import portfolio
+    holdings = portfolio.holdings(sorted(f.ticker for f in current_user.favorites))
+    return render_template("profile.html", holdings=holdings)
+
+
+@app.route('/screener', methods=['GET', 'POST'])
+@login_required
+def screener():
+    '''
+	returns the screener page, where we can value a list of tickers (typed or uploaded in a file), with the discount rate of the beta table or of the CAPM. The table is streamed as the companies are valued and sorted by margin of safety at the end.
+
+	Parameters: 
+		None
+
+	Returns: 
+		Response(stream_with_context(stream_template("screener.html", rows=rows, tickers=tickers, risk=risk)))
+'''
+    if request.method == 'POST':
+        import screener as scr
+        text = request.form.get('tickers', '')
+        upload = request.files.get('tickers_file')
+        if upload:
+            text += '\n' + upload.read().decode('utf-8', 'ignore')
+        tickers = scr.read_tickers(text)
+        risk = risk_model()
+        if not tickers:
+            flash('Write or upload at least one ticker.')
+            return render_template("screener.html", risk=risk)
+        def rows():
+            import financials as fin
+            import valuation_index
+            valued = []
+            for chunk in scr.screen(tickers, model=risk):
+                for row in chunk:
+                    valued.append(row)
+                    yield row
+            #the companies valued with the default discount rate are proposed by the search boxes and ranked by /api/top-undervalued
+            if risk == fin.RISK_MODEL:
+                valuation_index.update(valued)
+        rows = rows()
+        return Response(stream_with_context(stream_template("screener.html", rows=rows, tickers=tickers, risk=risk)))
+    return render_template("screener.html")
+
+
+@app.route('/metrics')
+def metrics_page():
+    '''
+	returns the timings of the stages, the upstream errors and the cache counters in the Prometheus text format
+
+	Parameters: 
+		None
+
+	Returns: 
+		Response(metrics.registry.render(...), mimetype='text/plain')
 '''
-    return render_template("profile.html")
+    import live
+    import upstream
+    stats = cache.ticker_cache.stats()
+    lookups = stats['hits'] + stats['misses']
+    gauges = [('tdlog_cache_' + name, (), value) for name, value in stats.items()]
+    gauges.append(('tdlog_cache_hit_ratio', (), stats['hits']/lookups if lookups else 0))
+    gauges.append(('tdlog_live_tickers', (), len(live.poller.subscribers)))
+    gauges += [('tdlog_circuit_open', (('host', host),), state) for host, state in upstream.client.states().items()]
+    return Response(metrics.registry.render(gauges), mimetype='text/plain; version=0.0.4')
+
+
+def favorite_tickers():
+    '''
+    Returns the tickers favorited by at least one user
+    '''
+    with app.app_context():
+        return [ticker for (ticker,) in sql.session.query(Favorite.ticker).distinct()]
+
+def start_prefetcher():
+    '''
+    Starts the background thread warming the data of the favorited and most viewed tickers
+    '''
+    import prefetch
+    prefetcher = prefetch.Prefetcher(favorite_tickers, fairprice)
+    prefetcher.start()
+    return prefetcher
+
+_prefetch_started = False
+_prefetch_lock = threading.Lock()
+
+def start_prefetcher_once():
+    '''
+    Starts the prefetcher in the process of the server which holds PREFETCH_LOCK; in the other processes
+    a thread waits for the lock, so that another one takes over when the owner exits
+    '''
+    global _prefetch_started
+    with _prefetch_lock:
+        if _prefetch_started:
+            return
+        _prefetch_started = True
+    def wait_for_lock():
+        lock = open(PREFETCH_LOCK, 'w')
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        # kept open (and locked) as long as the process lives
+        start_prefetcher_once.lock = lock
+        start_prefetcher()
+    threading.Thread(target=wait_for_lock, name='prefetch-lock', daemon=True).start()
 
 
 if __name__ == "__main__":
+    #with the reloader, only the child process serving the requests prefetches (at its first request)
+    init_db()
     app.run(debug=True)
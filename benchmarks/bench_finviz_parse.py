@@ -0,0 +1,42 @@
+'''
+Micro-benchmark of the Finviz parsing: full page tree with one search per metric
+(previous implementation) against the single walk over the snapshot cells.
+The pages are the synthetic fixtures of fixtures/finviz, built in the layout of the Finviz quote page.
+
+Usage: python benchmarks/bench_finviz_parse.py [repetitions]
+'''
+import glob
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bs4 import BeautifulSoup as bs
+
+import financials as fin
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fixtures', 'finviz')
+
+
+def parse_full_tree(html):
+    '''
+    Returns the metrics the way get_finviz_data used to find them: whole tree, one find per metric
+    '''
+    soup = bs(html, features="lxml")
+    return {m: fin.to_number(fin.fundamental_metric(soup, m)) for m in fin.metric}
+
+
+def main(repetitions=50):
+    pages = {os.path.basename(p)[:-5]: open(p, 'rb').read() for p in sorted(glob.glob(os.path.join(FIXTURES, '*.html')))}
+    for ticker, html in pages.items():
+        assert parse_full_tree(html) == fin.parse_finviz(html), ticker
+    print('%-8s %10s %12s %12s %8s' % ('ticker', 'size (kB)', 'full (ms)', 'single (ms)', 'speedup'))
+    for ticker, html in pages.items():
+        full = min(timeit.repeat(lambda: parse_full_tree(html), number=repetitions, repeat=3))/repetitions
+        single = min(timeit.repeat(lambda: fin.parse_finviz(html), number=repetitions, repeat=3))/repetitions
+        print('%-8s %10.1f %12.2f %12.2f %7.1fx' % (ticker, len(html)/1024, full*1000, single*1000, full/single))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
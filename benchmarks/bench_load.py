@@ -0,0 +1,117 @@
+'''
+End-to-end load benchmark run offline: the upstream calls are answered from the fixtures
+(offline.py) with an injected latency, and the ticker page, its api, the valuation functions
+and the Finviz parser are driven by concurrent clients.
+
+Usage: python benchmarks/bench_load.py [--clients 8] [--requests 200] [--latency 0.05]
+'''
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# the local data of the benchmark is written in a temporary folder
+os.environ.setdefault('TDLOG_DATA', tempfile.mkdtemp(prefix='tdlog-bench-'))
+os.environ['TDLOG_OFFLINE'] = '1'
+
+import numpy as np
+
+
+def report(name, durations, elapsed):
+    '''
+    Prints the p50/p95/p99 latency (ms) and the throughput of a list of durations
+    '''
+    p50, p95, p99 = np.percentile(np.asarray(durations)*1000, (50, 95, 99))
+    print('%-28s %7d %9.2f %9.2f %9.2f %10.1f' % (name, len(durations), p50, p95, p99, len(durations)/elapsed))
+
+
+def run(name, task, clients, requests):
+    '''
+    Calls task(i) requests times from clients threads, reports the latencies and returns the elapsed time
+    '''
+    durations = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client():
+        local = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            task(i)
+            local.append(time.perf_counter() - start)
+        with lock:
+            durations.extend(local)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    report(name, durations, elapsed)
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load benchmark")
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help="latency of each upstream call (s)")
+    args = parser.parse_args(argv)
+    os.environ['TDLOG_OFFLINE_LATENCY'] = str(args.latency)
+
+    import app
+    import cache
+    import financials as fin
+    import offline
+
+    app.init_db()
+    tickers = offline.tickers()
+    pages = [open(p, 'rb').read() for p in sorted(glob.glob(os.path.join(offline.FIXTURES, 'finviz', '*.html')))]
+    app.app.config['TESTING'] = True
+    local = threading.local()
+
+    def get(url):
+        if not hasattr(local, 'client'):
+            local.client = app.app.test_client()
+        response = local.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200, (url, response.status_code)
+
+    def ticker_page(i):
+        symbol = tickers[i % len(tickers)]
+        get('/ticker/%s' % symbol)
+        get('/api/ticker/%s/series?period=%s' % (symbol, ('5d', '1mo', '6mo', 'Max')[i % 4]))
+        get('/api/ticker/%s/valuation' % symbol)
+
+    print('%-28s %7s %9s %9s %9s %10s' % ('', 'calls', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'calls/s'))
+    # first views: every ticker downloaded from the stand-in
+    run('ticker page (cold)', ticker_page, min(args.clients, len(tickers)), len(tickers))
+    run('ticker page (warm)', ticker_page, args.clients, args.requests)
+    cache.ticker_cache.clear()
+    run('ticker page (memory cold)', ticker_page, args.clients, args.requests)
+    run('valuation api', lambda i: get('/api/ticker/%s/valuation?mode=scenarios' % tickers[i % len(tickers)]),
+        args.clients, args.requests)
+
+    companies = np.random.default_rng(0).uniform(1e8, 1e10, (4, 1000))
+    run('intrinsic_values 1000x100', lambda i: fin.intrinsic_values(companies[0], np.linspace(0, 20, 100), 5, 4,
+                                                                   np.linspace(5, 10, 100), companies[1], companies[2],
+                                                                   companies[3]), args.clients, args.requests)
+    run('fair_value_distribution', lambda i: fin.fair_value_distribution(1e9, 1e8, 1e8, 1e7, 8, 0.04, 7),
+        args.clients, args.requests)
+    run('parse_finviz', lambda i: fin.parse_finviz(pages[i % len(pages)]), args.clients, args.requests)
+    betas = np.random.default_rng(0).uniform(-0.5, 3, 100000)
+    run('discount_rates 100000', lambda i: fin.discount_rates(betas), args.clients, args.requests)
+    run('discount_rates capm 100000', lambda i: fin.discount_rates(betas, 'capm'), args.clients, args.requests)
+
+
+if __name__ == "__main__":
+    main()
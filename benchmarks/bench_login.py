@@ -0,0 +1,61 @@
+'''
+Login throughput benchmark: concurrent clients log in (bcrypt check in the hashing pool) for
+several cost factors, then load an authenticated page (user loaded through the short cache).
+
+Usage: python benchmarks/bench_login.py [--clients 8] [--requests 100] [--rounds 4 8 10 12]
+'''
+import argparse
+import threading
+
+# also puts the project on the path and runs the app offline in a temporary folder
+from bench_load import run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Login throughput benchmark")
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--rounds', type=int, nargs='+', default=[4, 8, 10, 12], help="bcrypt cost factors")
+    args = parser.parse_args(argv)
+
+    import app
+    app.init_db()
+    app.app.config['TESTING'] = True
+    app.app.config['WTF_CSRF_ENABLED'] = False
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = app.app.test_client()
+        return local.client
+
+    def post(url, data):
+        response = client().post(url, data=data)
+        assert response.status_code == 302, (url, response.status_code)
+
+    print('hashing pool: %d workers' % app.HASH_WORKERS)
+    print('%-28s %7s %9s %9s %9s %10s' % ('', 'calls', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'calls/s'))
+    for rounds in args.rounds:
+        # the cost factor is stored in the hash: each user is registered with its own
+        app.bcrypt._log_rounds = rounds
+        user = {'username': 'bench%02d' % rounds, 'password': 'password'}
+        post('/register', dict(user, email_adress='bench@example.com'))
+        elapsed = run('login (rounds=%d)' % rounds, lambda i: post('/login', user), args.clients, args.requests)
+        print('%-28s %10.1f' % ('  logins/s per worker', args.requests/elapsed/app.HASH_WORKERS))
+
+    # each thread logs in at its first call, with a user of the cheapest cost factor, then the user comes from the cache
+    app.bcrypt._log_rounds = min(args.rounds)
+    reader = {'username': 'bench_dashboard', 'password': 'password'}
+    post('/register', dict(reader, email_adress='bench@example.com'))
+
+    def dashboard(i):
+        if not hasattr(local, 'logged_in'):
+            post('/login', reader)
+            local.logged_in = True
+        response = client().get('/dashboard')
+        assert response.status_code == 200, response.status_code
+    run('dashboard (logged in)', dashboard, args.clients, args.requests*10)
+
+
+if __name__ == "__main__":
+    main()
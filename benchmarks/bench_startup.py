@@ -0,0 +1,71 @@
+'''
+Startup benchmark: in fresh processes, time of "import app" and of the first responses of the
+home page, the login page and a ticker page (offline), as a new worker would serve them.
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--max-import SECONDS]
+
+With --max-import, the exit status is 1 when the median import time is above the budget; the
+same budget is checked by tests/test_startup.py, run with the other tests.
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+#run in a new process: prints the durations as JSON
+PROBE = '''
+import json, time
+start = time.perf_counter()
+import app
+durations = {'import app': time.perf_counter() - start}
+# the upstream calls of the ticker page are answered from the fixtures, installed after the import is timed
+import offline
+offline.install(0)
+app.init_db()
+client = app.app.test_client()
+for url in ('/', '/login', '/ticker/AAPL'):
+    start = time.perf_counter()
+    response = client.get(url)
+    assert response.status_code == 200, (url, response.status_code)
+    durations['first GET ' + url] = time.perf_counter() - start
+print(json.dumps(durations))
+'''
+
+
+def probe():
+    '''
+    Returns the durations measured by PROBE in a new process, with an empty data folder
+    '''
+    environment = dict(os.environ, TDLOG_DATA=tempfile.mkdtemp(prefix='tdlog-bench-'))
+    environment.pop('TDLOG_OFFLINE', None)
+    # the prefetcher would add its own downloads to the measures
+    environment['TDLOG_PREFETCH'] = '0'
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=environment,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Startup benchmark")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-import', type=float, help="budget (s) of the median import time")
+    args = parser.parse_args(argv)
+
+    runs = [probe() for _ in range(args.runs)]
+    print('%-28s %9s %9s %9s' % ('', 'min (ms)', 'p50 (ms)', 'max (ms)'))
+    for name in runs[0]:
+        durations = np.array([run[name] for run in runs])*1000
+        print('%-28s %9.1f %9.1f %9.1f' % (name, durations.min(), np.median(durations), durations.max()))
+    median = np.median([run['import app'] for run in runs])
+    if args.max_import is not None and median > args.max_import:
+        sys.exit('import app takes %.3f s, above the budget of %.3f s' % (median, args.max_import))
+
+
+if __name__ == "__main__":
+    main()
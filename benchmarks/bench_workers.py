@@ -0,0 +1,87 @@
+'''
+Multi-worker benchmark: N processes, like the gunicorn workers, start together on the same data
+folder and ask for the valuation of the same tickers (offline). Prints the number of upstream
+downloads of all the workers, with the shared cache and without it (TDLOG_CACHE_URL=none).
+
+Usage: python benchmarks/bench_workers.py [--workers 4] [--tickers AAPL MSFT KO] [--latency 0.2]
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+#run in a new process: waits for the start time, then prints the number of downloads and the duration as JSON
+PROBE = '''
+import json, os, sys, time
+import app
+import offline
+import metrics
+offline.install(float(os.environ['BENCH_LATENCY']))
+client = app.app.test_client()
+time.sleep(max(0, float(os.environ['BENCH_START']) - time.time()))
+start = time.perf_counter()
+for ticker in sys.argv[1:]:
+    response = client.get('/api/ticker/%s/valuation' % ticker)
+    assert response.status_code == 200, (ticker, response.status_code)
+duration = time.perf_counter() - start
+downloads = sum(histogram['count'] for (name, labels), histogram in metrics.registry.histograms.items()
+                if name == 'tdlog_stage_seconds' and dict(labels)['stage'].startswith(('finviz_http', 'yfinance_')))
+print(json.dumps({'downloads': downloads, 'seconds': duration}))
+'''
+
+
+def run(workers, tickers, latency, cache_url=None):
+    '''
+    Returns the results of PROBE in workers processes started together on a new data folder
+
+            Parameters:
+                    workers (int): number of processes
+                    tickers (list): tickers valued by each process
+                    latency (float): seconds of each offline download
+                    cache_url (str): TDLOG_CACHE_URL of the processes (the default shared cache if None)
+
+            Returns:
+                    results (list): one dict per process with its downloads and duration
+    '''
+    environment = dict(os.environ, TDLOG_DATA=tempfile.mkdtemp(prefix='tdlog-bench-'),
+                       BENCH_LATENCY=str(latency), BENCH_START=str(time.time() + 3))
+    environment.pop('TDLOG_OFFLINE', None)
+    # the prefetcher would add its own downloads to the measures
+    environment['TDLOG_PREFETCH'] = '0'
+    if cache_url is not None:
+        environment['TDLOG_CACHE_URL'] = cache_url
+    # the schema is created once, like with flask init-db before the server starts
+    subprocess.run([sys.executable, '-c', 'import app; app.init_db()'], cwd=ROOT, env=environment, check=True)
+    processes = [subprocess.Popen([sys.executable, '-c', PROBE] + tickers, cwd=ROOT, env=environment,
+                                  stdout=subprocess.PIPE, text=True) for _ in range(workers)]
+    results = []
+    for process in processes:
+        output, _ = process.communicate()
+        if process.returncode:
+            sys.exit('a worker failed')
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-worker benchmark")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--tickers', nargs='+', default=['AAPL', 'MSFT', 'KO'])
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds of each offline download")
+    args = parser.parse_args(argv)
+
+    print('%-22s %10s %14s %12s' % ('', 'downloads', 'per worker', 'max (s)'))
+    for name, cache_url in (('shared cache', None), ('no shared cache', 'none')):
+        results = run(args.workers, args.tickers, args.latency, cache_url)
+        downloads = sum(result['downloads'] for result in results)
+        print('%-22s %10d %14.1f %12.2f' % (name, downloads, downloads/args.workers,
+                                             max(result['seconds'] for result in results)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import shared_cache
+from metrics import span
+
+#time to live (in seconds) of each kind of data
+TTL = {'info': 6*3600,
+       'cashflow': 12*3600,
+       'balancesheet': 12*3600,
+       'history': 5*60,
+       'fairvalue': 3600,
+       'fmp': 12*3600,
+       'finviz': 3600,
+       'bars': 5*60,
+       'exists': 6*3600
+       }
+
+#upper bound of the memory used by the cached values
+MAX_BYTES = 64*1024*1024
+
+
+def sizeof(value):
+    '''
+    Returns an estimate of the memory used by a cached value
+
+            Parameters:
+                    value (object): a DataFrame, Series, dict, list or scalar
+
+            Returns:
+                    size (int): estimated size in bytes
+    '''
+    if hasattr(value, 'memory_usage'):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class SingleFlight:
+    '''
+    Deduplicates concurrent calls: while a call for a key is running, other callers
+    of the same key wait for it and share its result instead of calling again
+    '''
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        '''
+        Returns fn(), running it only once for all the concurrent callers of key
+
+            Parameters:
+                    key (hashable): identifies the upstream call
+                    fn (function): the upstream call
+
+            Returns:
+                    result (object): the value returned by fn (its exception is raised to every caller)
+        '''
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'done': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+
+flight = SingleFlight()
+
+
+class TTLCache:
+    '''
+    Thread-safe LRU cache whose entries expire after a time depending on their kind
+
+            Parameters:
+                    ttl (dict): time to live in seconds for each kind of data
+                    max_bytes (int): memory cap, the least recently used entries are evicted above it
+                    default_ttl (int): time to live of the kinds missing from ttl
+                    flight (SingleFlight): coalesces the concurrent misses of a same entry
+                    shared (SharedCache): cache of the other processes, read on a miss and written on a put, or None
+    '''
+
+    def __init__(self, ttl=TTL, max_bytes=MAX_BYTES, default_ttl=300, flight=flight, shared=None):
+        self.ttl = dict(ttl)
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.flight = flight
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evictions = 0
+
+    def peek(self, kind, key, stale=False):
+        '''
+        Returns the cached value of (kind, key), or None if it is missing or expired; the expired values
+        stay until they are evicted, and are returned with stale=True (when the upstream is down);
+        the values missing from this process are read from the shared cache
+        '''
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is not None and (entry[0] > now or stale):
+                self._entries.move_to_end((kind, key))
+                return entry[2]
+        if self.shared is None:
+            return None
+        value, expires = self.shared.get(kind, key)
+        if value is None or (expires <= time.time() and not stale):
+            return None
+        self.remember(kind, key, value, expires - time.time())
+        with self._lock:
+            self.shared_hits += 1
+        return value
+
+    def put(self, kind, key, value):
+        '''
+        Stores a value, in this process and in the shared cache
+        '''
+        seconds = self.ttl.get(kind, self.default_ttl)
+        self.remember(kind, key, value, seconds)
+        if self.shared is not None:
+            self.shared.put(kind, key, value, time.time() + seconds)
+
+    def remember(self, kind, key, value, seconds):
+        '''
+        Stores a value in this process for some seconds and evicts the least recently used entries above the memory cap
+        '''
+        size = sizeof(value)
+        expires = time.monotonic() + seconds
+        with self._lock:
+            old = self._entries.pop((kind, key), None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[(kind, key)] = (expires, size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, old_size, _) = self._entries.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+
+    def get(self, kind, key, loader):
+        '''
+        Returns the cached value of (kind, key), calling loader() to fill the cache on a miss
+
+            Parameters:
+                    kind (str): kind of data, selects the time to live
+                    key (hashable): identifies the value inside its kind
+                    loader (function): fetches the value when it is not cached
+
+            Returns:
+                    value (object): the cached or freshly loaded value
+        '''
+        value = self.peek(kind, key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._lock:
+            self.misses += 1
+        return self.flight.do((kind, key), lambda: self._load(kind, key, loader))
+
+    def _load(self, kind, key, loader):
+        try:
+            if self.shared is not None:
+                # another process may have the value, or be downloading it
+                value, expires = self.shared.load(kind, key, self.ttl.get(kind, self.default_ttl), loader)
+                if value is not None:
+                    self.remember(kind, key, value, expires - time.time())
+                return value
+            value = loader()
+        except Exception as e:
+            value = self.peek(kind, key, stale=True)
+            if value is None:
+                raise
+            print ('Serving stale ' + kind + ' of ' + repr(key) + ': ' + repr(e))
+            return value
+        if value is not None:
+            self.put(kind, key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        '''
+        Returns the counters of the cache
+
+            Returns:
+                    stats (dict): hits (of which from the shared cache), misses, coalesced misses, evictions, number of entries and used bytes
+        '''
+        with self._lock:
+            return {'hits': self.hits,
+                    'shared_hits': self.shared_hits,
+                    'misses': self.misses,
+                    'coalesced': self.flight.coalesced,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': self.bytes}
+
+
+#the downloaded data is shared by the workers of the server
+ticker_cache = TTLCache(shared=shared_cache.from_url())
+
+
+class CachedTicker:
+    '''
+    Wraps a yfinance Ticker so that info, history and the statements go through the cache
+
+            Parameters:
+                    ticker (str): the company ticker
+                    cache (TTLCache): cache storing the downloaded data
+    '''
+
+    def __init__(self, ticker, cache=ticker_cache):
+        self.ticker = ticker.upper()
+        self._cache = cache
+        self._acao = None
+
+    def download(self, name, **kwargs):
+        '''
+        Returns an attribute of the yfinance Ticker object (or calls it with kwargs) through the upstream client, timing the download
+        '''
+        import upstream
+        def download():
+            attribute = getattr(self.upstream(), name)
+            return attribute(**kwargs) if callable(attribute) else attribute
+        with span('yfinance_' + name, upstream=True):
+            return upstream.client.run('yahoo', download)
+
+    def upstream(self):
+        '''
+        Returns the yfinance Ticker object, created only when something has to be downloaded
+        '''
+        if self._acao is None:
+            import yfinance as yf
+            self._acao = yf.Ticker(self.ticker)
+        return self._acao
+
+    #info and the statements are read from the persistent store before being downloaded
+    def stored(self, kind):
+        from store import store
+        return self._cache.get(kind, self.ticker, lambda: store.fetch(kind, self.ticker, lambda: self.download(kind)))
+
+    @property
+    def info(self):
+        return self.stored('info')
+
+    @property
+    def cashflow(self):
+        return self.stored('cashflow')
+
+    @property
+    def balancesheet(self):
+        return self.stored('balancesheet')
+
+    def history(self, period="5d", **kwargs):
+        key = (self.ticker, period) + tuple(sorted(kwargs.items()))
+        return self._cache.get('history', key, lambda: self.download('history', period=period, **kwargs))
+
+
+def get_finviz_data(ticker):
+    '''
+    Returns the Finviz metrics of a ticker from the cache or the persistent store, sharing one scrape between the concurrent requests
+
+            Parameters:
+                    ticker (str): A company ticker
+
+            Returns:
+                    dict_finviz (dict): A dictionary containing the desired metrics
+    '''
+    import financials as fin
+    from store import store
+    #a failed scrape (empty metrics) is not cached
+    dict_finviz = ticker_cache.get('finviz', ticker.upper(), lambda: store.fetch('finviz', ticker, lambda: fin.get_finviz_data(ticker)) or None)
+    return dict_finviz if dict_finviz is not None else {}
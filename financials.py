@@ -1,9 +1,60 @@
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup as bs
+from lxml import html as lxml_html
+import numpy as np
+import os
+import re
+
+from metrics import span
+import upstream
+
+#source of the statements of the DCF model: 'yfinance' or 'fmp' (financialmodelingprep, see fmp.py)
+SOURCE = os.environ.get('TDLOG_FUNDAMENTALS', 'yfinance')
+
+#model of the discount rate: 'table' (the rate of the interval of the beta) or 'capm'
+RISK_MODEL = os.environ.get('TDLOG_RISK_MODEL', 'table')
+RISK_MODELS = ('table', 'capm')
+#discount rate (%) of each interval of beta: below 0.8 5%, from 0.8 to 1 6%, ..., from 1.6 9%
+BETA_BREAKPOINTS = np.array([0.8, 1, 1.1, 1.2, 1.3, 1.4, 1.6])
+BETA_RATES = np.array([5, 6, 6.5, 7, 7.5, 8, 8.5, 9])
+#CAPM: risk free rate + beta x equity risk premium (%)
+RISK_FREE_RATE = float(os.environ.get('TDLOG_RISK_FREE_RATE', 4))
+EQUITY_PREMIUM = float(os.environ.get('TDLOG_EQUITY_PREMIUM', 5))
 
 #metrics needed to calculate the fair value
 metric = ['Price', 'EPS next 5Y', 'Beta', 'Shs Outstand']
 
+FINVIZ_URL = "https://finviz.com/quote.ashx?t="
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:20.0) Gecko/20100101 Firefox/20.0'}
+TIMEOUT = 10
+
+# the cells (labels and values) of the snapshot table have the class 'snapshot-td2'
+SNAPSHOT_CELLS = "//td[contains(concat(' ', @class, ' '), ' snapshot-td2')]"
+
+def make_session():
+    '''
+    Returns a keep-alive HTTP session with a connection pool (the retries are done by the upstream client)
+
+            Returns:
+                    session (requests.Session): the session shared by the scrapes
+    '''
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(HEADERS)
+    return session
+
+session = make_session()
+
+#number of years of each stage of the DCF projection (years 1 to 5, 6 to 10 and 11 to 20)
+STAGES = (5, 5, 10)
+YEARS = np.arange(1, sum(STAGES) + 1)
+
+#growth used for the years 11 to 20 of the projection (the years 6 to 10 grow by half of the 5Y growth)
+EPS_GROWTH_11Y_TO_20Y = 0.04
+
 def fundamental_metric(soup,metric):
     '''
     Returns a value of a certain metric in a parsed website
@@ -18,7 +69,108 @@ def fundamental_metric(soup,metric):
 
     # the table which stores the data in Finviz has html table attribute class of 'snapshot-td2'
     return soup.find(text = metric).find_next(class_='snapshot-td2').text
-   
+
+def to_number(value):
+    '''
+    Converts a Finviz value (percentage, billions, millions) to a float, or returns it unchanged
+
+            Parameters:
+                    value (str): value as displayed in the website
+
+            Returns:
+                    value (float or str): the converted value, or the original string (e.g. '-')
+    '''
+    # replace percentages
+    if value[-1:]=='%':
+        value = value[:-1]
+    # billion
+    elif value[-1:]=='B':
+        try:
+            return float(value[:-1])*1000000000
+        except ValueError:
+            return value
+    # million
+    elif value[-1:]=='M':
+        try:
+            return float(value[:-1])*1000000
+        except ValueError:
+            return value
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+def snapshot_table(html):
+    '''
+    Returns the part of a Finviz quote page holding the snapshot table, or the whole page if it is not found
+
+            Parameters:
+                    html (bytes or str): the Finviz quote page
+
+            Returns:
+                    html (bytes): the snapshot table
+    '''
+    if isinstance(html, str):
+        html = html.encode('utf-8')
+    position = html.find(b'snapshot-table2')
+    start = html.rfind(b'<table', 0, position)
+    end = html.find(b'</table>', position)
+    if position == -1 or start == -1 or end == -1:
+        return html
+    return html[start:end + len(b'</table>')]
+
+def parse_finviz(html, metrics=metric):
+    '''
+    Extracts the metrics from a Finviz quote page in a single walk over the snapshot table
+
+            Parameters:
+                    html (bytes or str): the Finviz quote page
+                    metrics (list): desired metrics
+
+            Returns:
+                    dict_finviz (dict): A dictionary containing the metrics found in the page
+    '''
+    wanted = set(metrics)
+    dict_finviz = {}
+    pending = None
+    with span('finviz_parse'):
+        for td in lxml_html.fromstring(snapshot_table(html)).xpath(SNAPSHOT_CELLS):
+            text = td.text_content().strip()
+            if pending is not None and 'snapshot-td2' in td.get('class', '').split():
+                dict_finviz[pending] = to_number(text)
+                pending = None
+                if len(dict_finviz) == len(wanted):
+                    break
+            elif text in wanted and text not in dict_finviz:
+                pending = text
+    return dict_finviz
+
+def company_name(html):
+    '''
+    Returns the company name found in the title of a Finviz quote page ("AAPL - Apple Inc. Stock Price..."), or ''
+    '''
+    if isinstance(html, bytes):
+        html = html.decode('utf-8', 'ignore')
+    match = re.search(r'<title>\s*\S+\s+(?:-\s+)?(.*?)\s+Stock\b', html)
+    return match.group(1) if match else ''
+
+def fetch_finviz_html(ticker):
+    '''
+    Downloads the Finviz quote page of a ticker through the shared session and the upstream client
+
+            Parameters:
+                    ticker (str): A company ticker
+
+            Returns:
+                    html (bytes): the page content
+    '''
+    def download():
+        response = session.get(FINVIZ_URL + ticker.lower(), timeout=TIMEOUT)
+        response.raise_for_status()
+        return response.content
+    with span('finviz_http', upstream=True):
+        return upstream.client.run('finviz', download)
+
 def get_finviz_data(ticker):
     '''
     Returns a dictionary of metrics found in the ewbsite Finviz for a given company ticker
@@ -27,70 +179,141 @@ def get_finviz_data(ticker):
                     ticker (str): A company ticker  
 
             Returns:
-                    dict_finviz (dict): A dictionary containing the desired metrics 
+                    dict_finviz (dict): A dictionary containing the desired metrics and the company name ('Name')
     '''
+    dict_finviz = {}
     try:
-        url = ("http://finviz.com/quote.ashx?t=" + ticker.lower())
-        soup = bs(requests.get(url,headers={'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:20.0) Gecko/20100101 Firefox/20.0'}).content,features="lxml")
-        dict_finviz = {}        
-        for m in metric:   
-            dict_finviz[m] = fundamental_metric(soup,m)
-        for key, value in dict_finviz.items():
-            # replace percentages
-            if (value[-1]=='%'):
-                dict_finviz[key] = value[:-1]
-                dict_finviz[key] = float(dict_finviz[key])
-            # billion
-            if (value[-1]=='B'):
-                dict_finviz[key] = value[:-1]
-                dict_finviz[key] = float(dict_finviz[key])*1000000000  
-            # million
-            if (value[-1]=='M'):
-                dict_finviz[key] = value[:-1]
-                dict_finviz[key] = float(dict_finviz[key])*1000000
-            try:
-                dict_finviz[key] = float(dict_finviz[key])
-            except:
-                pass    
+        html = fetch_finviz_html(ticker)
+        dict_finviz = parse_finviz(html)
+        missing = [m for m in metric if m not in dict_finviz]
+        if missing:
+            print ('Metrics not found for ' + ticker + ': ' + ', '.join(missing))
+        #only with metrics, an empty dictionary means the scrape failed
+        if dict_finviz:
+            dict_finviz['Name'] = company_name(html)
     except Exception as e:
         print (e)
         print ('Not successful parsing ' + ticker + ' data.')      
     return dict_finviz
 
-def discount_rate(finviz_data):
+def discount_rates(betas, model=None, breakpoints=BETA_BREAKPOINTS, rates=BETA_RATES):
+    '''
+    Returns the discount rates of many companies from their betas, in one vectorized call
+
+            Parameters:
+                    betas (array): the betas (NaN when unknown)
+                    model (str): 'table' or 'capm', RISK_MODEL by default
+                    breakpoints (array): increasing betas where the rate of the table changes
+                    rates (array): rate (%) of each interval, one more than the breakpoints
+
+            Returns:
+                    discount_rates (array): the discount rates in %, NaN for the unknown betas
+    '''
+    betas = np.asarray(betas, dtype=float)
+    model = model or RISK_MODEL
+    if model == 'capm':
+        return RISK_FREE_RATE + betas*EQUITY_PREMIUM
+    if model != 'table':
+        raise ValueError('Unknown risk model: ' + repr(model))
+    # a beta equal to a breakpoint is in the interval starting there
+    values = np.asarray(rates, dtype=float)[np.searchsorted(breakpoints, betas, side='right')]
+    return np.where(np.isnan(betas), np.nan, values)
+
+def discount_rate(finviz_data, model=None):
     '''
     Returns the dicount rate for a given value of beta
 
             Parameters:
                     finviz_data (dict): dictionary containing the beta value
+                    model (str): 'table' or 'capm', RISK_MODEL by default
 
             Returns:
-                    discount_rate (float): the corresponding discount rate
+                    discount_rate (float): the corresponding discount rate, or None if the beta is unknown
     '''
     Beta = finviz_data['Beta']
-    discount_rate = 7
     if type(Beta)==str:
         return None
-    if(Beta<0.80):
-        discount_rate = 5
-    elif(Beta>=0.80 and Beta<1):
-        discount_rate = 6
-    elif(Beta>=1 and Beta<1.1):
-        discount_rate = 6.5
-    elif(Beta>=1.1 and Beta<1.2):
-        discount_rate = 7
-    elif(Beta>=1.2 and Beta<1.3):
-        discount_rate =7.5
-    elif(Beta>=1.3 and Beta<1.4):
-        discount_rate = 8
-    elif(Beta>=1.4 and Beta<1.6):
-        discount_rate = 8.5
-    elif(Beta>=1.61):
-        discount_rate = 9   
-
-    return discount_rate
-
-def calculate_intrinsic_value(acao,EPS_growth_5Y, EPS_growth_6Y_to_10Y, EPS_growth_11Y_to_20Y, discount_rate,finviz_data):
+    return float(discount_rates([Beta], model)[0])
+
+def statement_values(acao, source=None):
+    '''
+    Returns the values of the last statements needed by the DCF model
+
+            Parameters:
+                    acao (ticker object): target company
+                    source (str): 'yfinance' or 'fmp', SOURCE by default
+
+            Returns:
+                    cash_flow (float): last free cash flow
+                    total_debt (float): long and short term debt
+                    cash_and_ST_investments (float): cash of the company
+    '''
+    if (source or SOURCE) == 'fmp':
+        import fmp
+        return fmp.statement_values(acao.ticker)
+    FCF2=acao.cashflow.loc['Total Cash From Operating Activities']+acao.cashflow.loc['Capital Expenditures']
+    cash_flow=FCF2.iloc[0]
+    total_debt=acao.balancesheet.loc['Long Term Debt'].iloc[0]+acao.balancesheet.loc['Short Long Term Debt'].iloc[0]
+    cash_and_ST_investments=acao.balancesheet.loc['Cash'].iloc[0]
+    return cash_flow, total_debt, cash_and_ST_investments
+
+def intrinsic_values(cash_flow, EPS_growth_5Y, EPS_growth_6Y_to_10Y, EPS_growth_11Y_to_20Y, discount_rate,
+                     total_debt, cash_and_ST_investments, shares_outstanding):
+    '''
+    Returns the fair values of N companies under M scenarios according to the DCF model, in one vectorized computation
+
+            Parameters:
+                    cash_flow (array of N floats): last free cash flow of each company
+                    EPS_growth_5Y (float, array of M or N x M floats): percentage growth in the next 5Y
+                    EPS_growth_6Y_to_10Y (float, array of M or N x M floats): percentage growth in the next 6 to 10Y
+                    EPS_growth_11Y_to_20Y (float, array of M or N x M floats): percentage growth in the next 11 to 20Y
+                    discount_rate (float, array of M or N x M floats): percentage discount rate of the cashflows
+                    total_debt (array of N floats): debt of each company
+                    cash_and_ST_investments (array of N floats): cash of each company
+                    shares_outstanding (array of N floats): number of shares of each company
+
+            Returns:
+                    intrinsic_values (N x M array): the fair value of each company under each scenario
+    '''
+    def company(values):
+        return np.asarray(values, dtype=float).reshape(-1, 1)
+
+    def scenario(values):
+        values = np.asarray(values, dtype=float)
+        return values.reshape(1, -1) if values.ndim < 2 else values
+
+    with span('dcf'):
+        # growth factor of each year: (1 + g) repeated over the years of its stage, then compounded
+        stages = [scenario(g) for g in (EPS_growth_5Y, EPS_growth_6Y_to_10Y, EPS_growth_11Y_to_20Y)]
+        shape = np.broadcast_shapes(*(g.shape for g in stages))
+        factors = np.concatenate([np.repeat(1 + np.broadcast_to(g, shape)[..., None]/100, n, axis=-1)
+                                  for g, n in zip(stages, STAGES)], axis=-1)
+        growth = np.cumprod(factors, axis=-1)
+
+        # discount factor of each year for each rate
+        discount = (1 + scenario(discount_rate)[..., None]/100) ** -YEARS
+
+        cash_flow_discounted = company(cash_flow) * (growth * discount).sum(axis=-1)
+        return (cash_flow_discounted - company(total_debt) + company(cash_and_ST_investments))/company(shares_outstanding)
+
+def fair_values(cash_flow, total_debt, cash_and_ST_investments, shares_outstanding, EPS_growth_5Y, discount_rate):
+    '''
+    Returns the fair values of N companies with the assumptions of the ticker page, in one batched computation
+
+            Parameters:
+                    cash_flow, total_debt, cash_and_ST_investments, shares_outstanding (arrays of N floats): as in intrinsic_values
+                    EPS_growth_5Y (array of N floats): percentage growth in the next 5Y of each company
+                    discount_rate (array of N floats): discount rate of each company
+
+            Returns:
+                    fair_values (array of N floats): the fair value of each company
+    '''
+    growth_5Y = np.asarray(EPS_growth_5Y, dtype=float).reshape(-1, 1)
+    rates = np.asarray(discount_rate, dtype=float).reshape(-1, 1)
+    return intrinsic_values(cash_flow, growth_5Y, growth_5Y/2, EPS_GROWTH_11Y_TO_20Y, rates,
+                            total_debt, cash_and_ST_investments, shares_outstanding)[:, 0]
+
+def calculate_intrinsic_value(acao,EPS_growth_5Y, EPS_growth_6Y_to_10Y, EPS_growth_11Y_to_20Y, discount_rate,finviz_data,source=None):
     '''
     Returns the fair value of a company according to the DCF model
 
@@ -101,54 +324,68 @@ def calculate_intrinsic_value(acao,EPS_growth_5Y, EPS_growth_6Y_to_10Y, EPS_grow
                     EPS_growth_11Y_to_20Y (float): percentage growth in the next 11 to 20Y
                     discount_rate (float): discount rate of the company's cashflows
                     finviz_data (dict): dictionary containing the metrics
+                    source (str): source of the statements, 'yfinance' or 'fmp' (SOURCE by default)
 
             Returns:
                     intrinsic_value (float): the company's fair value
     '''   
-    #get values
-    FCF2=acao.cashflow.loc['Total Cash From Operating Activities']+acao.cashflow.loc['Capital Expenditures']
-    cash_flow=FCF2[0]
-    total_debt=acao.balancesheet.loc['Long Term Debt'][0]+acao.balancesheet.loc['Short Long Term Debt'][0]
-    cash_and_ST_investments=acao.balancesheet.loc['Cash'][0]
+    cash_flow, total_debt, cash_and_ST_investments = statement_values(acao, source)
     shares_outstanding=finviz_data['Shs Outstand']
-    
-    
-    # Convert all percentages to decmials
-    EPS_growth_5Y_d = EPS_growth_5Y/100
-    EPS_growth_6Y_to_10Y_d = EPS_growth_6Y_to_10Y/100
-    EPS_growth_11Y_to_20Y_d = EPS_growth_11Y_to_20Y/100
-    discount_rate_d = discount_rate/100
-    
-    # Lists of projected cash flows from year 1 to year 20
-    cash_flow_list = []
-    cash_flow_discounted_list = []
-    year_list = []
-    
-    
-    # Years 1 to 5
-    for year in range(1, 6):
-        year_list.append(year)
-        cash_flow*=(1 + EPS_growth_5Y_d)        
-        cash_flow_list.append(cash_flow)
-        cash_flow_discounted = cash_flow/((1 + discount_rate_d)**year)
-        cash_flow_discounted_list.append(cash_flow_discounted)
-    
-    # Years 6 to 10
-    for year in range(6, 11):
-        year_list.append(year)
-        cash_flow*=(1 + EPS_growth_6Y_to_10Y_d)
-        cash_flow_list.append(cash_flow)
-        cash_flow_discounted = cash_flow/((1 + discount_rate_d)**year)
-        cash_flow_discounted_list.append(cash_flow_discounted)
-    
-    # Years 11 to 20
-    for year in range(11, 21):
-        year_list.append(year)
-        cash_flow*=(1 + EPS_growth_11Y_to_20Y_d)
-        cash_flow_list.append(cash_flow)
-        cash_flow_discounted = cash_flow/((1 + discount_rate_d)**year)
-        cash_flow_discounted_list.append(cash_flow_discounted)
-    
-    intrinsic_value = (sum(cash_flow_discounted_list) - total_debt + cash_and_ST_investments)/shares_outstanding
-
-    return round(intrinsic_value,2)
+
+    intrinsic_value = intrinsic_values(cash_flow, EPS_growth_5Y, EPS_growth_6Y_to_10Y, EPS_growth_11Y_to_20Y, discount_rate,
+                                       total_debt, cash_and_ST_investments, shares_outstanding)[0, 0]
+
+    return round(float(intrinsic_value),2)
+
+#percentiles of the fair value distribution shown on the ticker page
+PERCENTILES = (5, 25, 50, 75, 95)
+
+def fair_value_distribution(cash_flow, total_debt, cash_and_ST_investments, shares_outstanding,
+                            EPS_growth_5Y, EPS_growth_11Y_to_20Y, discount_rate, n_scenarios=10000, seed=None):
+    '''
+    Returns percentiles of the fair value over random growth and discount rate scenarios
+
+            Parameters:
+                    cash_flow (float): last free cash flow
+                    total_debt (float): debt of the company
+                    cash_and_ST_investments (float): cash of the company
+                    shares_outstanding (float): number of shares
+                    EPS_growth_5Y (float): central percentage growth in the next 5Y (the years 6 to 10 grow by half of it)
+                    EPS_growth_11Y_to_20Y (float): percentage growth in the next 11 to 20Y
+                    discount_rate (float): central discount rate
+                    n_scenarios (int): number of sampled scenarios
+                    seed (int): seed of the random generator
+
+            Returns:
+                    percentiles (array): the fair value at each of PERCENTILES
+    '''
+    rng = np.random.default_rng(seed)
+    growth_5Y = rng.normal(EPS_growth_5Y, max(abs(EPS_growth_5Y)/4, 1), n_scenarios)
+    rates = np.maximum(rng.normal(discount_rate, 1, n_scenarios), 1)
+    values = intrinsic_values(cash_flow, growth_5Y, growth_5Y/2, EPS_growth_11Y_to_20Y, rates,
+                              total_debt, cash_and_ST_investments, shares_outstanding)[0]
+    return np.percentile(values, PERCENTILES)
+
+def sensitivity_grid(cash_flow, total_debt, cash_and_ST_investments, shares_outstanding,
+                     EPS_growth_5Y, EPS_growth_11Y_to_20Y, discount_rate,
+                     growth_steps=(-10, -5, 0, 5, 10), rate_steps=(-2, -1, 0, 1, 2)):
+    '''
+    Returns the fair value for every pair of 5Y growth and discount rate around the central assumptions
+
+            Parameters:
+                    cash_flow, total_debt, cash_and_ST_investments, shares_outstanding, EPS_growth_5Y,
+                    EPS_growth_11Y_to_20Y, discount_rate: as in fair_value_distribution
+                    growth_steps (tuple): percentage points added to EPS_growth_5Y
+                    rate_steps (tuple): percentage points added to discount_rate
+
+            Returns:
+                    growths (array): the 5Y growths of the rows
+                    rates (array): the discount rates of the columns
+                    values (2D array): the fair value of each growth (row) and rate (column)
+    '''
+    growths = EPS_growth_5Y + np.asarray(growth_steps, dtype=float)
+    rates = discount_rate + np.asarray(rate_steps, dtype=float)
+    growth_5Y = np.repeat(growths, len(rates))
+    values = intrinsic_values(cash_flow, growth_5Y, growth_5Y/2, EPS_growth_11Y_to_20Y, np.tile(rates, len(growths)),
+                              total_debt, cash_and_ST_investments, shares_outstanding)[0]
+    return growths, rates, values.reshape(len(growths), len(rates))
@@ -0,0 +1,198 @@
+'''
+Fundamentals from financialmodelingprep (the source of the prototype in "TDLOG code.py"), as an
+alternative to the yfinance statements: the statements of many tickers are downloaded concurrently,
+gathered in one long frame (one row per ticker, period and date) and reduced with vectorized
+groupbys to the values of the DCF model, in columns indexed by ticker.
+
+Usage: python fmp.py TICKERS_FILE [--output fundamentals.csv] [--chunk N]
+
+The API key is read from TDLOG_FMP_KEY ("demo" only answers for a few tickers).
+'''
+import argparse
+import os
+import sys
+
+import pandas as pd
+import requests
+
+import cache
+import financials as fin
+import upstream
+from metrics import span
+
+BASE_URL = "https://financialmodelingprep.com/api/v3/"
+API_KEY = os.environ.get('TDLOG_FMP_KEY', 'demo')
+
+#endpoint and fields of each statement
+STATEMENTS = {'cashflow': ('cash-flow-statement', ['freeCashFlow']),
+              'balancesheet': ('balance-sheet-statement', ['totalDebt', 'cashAndShortTermInvestments'])
+              }
+#downloads of each ticker: the last quarters give the TTM cash flow and the last balance sheet,
+#the annual cash flow is used when less than 4 quarters are published
+DOWNLOADS = (('cashflow', 'quarter'), ('cashflow', 'annual'), ('balancesheet', 'quarter'))
+#number of quarters (and years) downloaded
+LIMIT = 8
+#number of tickers of each chunk of the ingestion
+CHUNK = 100
+
+COLUMNS = ['ticker', 'statement', 'period', 'date', 'freeCashFlow', 'totalDebt', 'cashAndShortTermInvestments']
+
+
+def statement_url(ticker, statement, period):
+    endpoint = STATEMENTS[statement][0]
+    return '%s%s/%s?period=%s&limit=%d&apikey=%s' % (BASE_URL, endpoint, ticker.upper(), period, LIMIT, API_KEY)
+
+
+def error_message(error, endpoint, period):
+    if error.response is not None:
+        return 'HTTP %d from %s (%s)' % (error.response.status_code, endpoint, period)
+    return '%s calling %s (%s)' % (type(error).__name__, endpoint, period)
+
+
+def download(job):
+    '''
+    Downloads one statement of a ticker and returns its rows in the columns of the long frame
+
+            Parameters:
+                    job (tuple): ticker, statement ('cashflow' or 'balancesheet') and period ('quarter' or 'annual')
+
+            Returns:
+                    rows (DataFrame): one row per published date
+    '''
+    ticker, statement, period = job
+    try:
+        response = fin.session.get(statement_url(ticker, statement, period), timeout=fin.TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        # the messages of requests contain the url, and so the API key: only the endpoint and the status are kept
+        raise type(e)(error_message(e, STATEMENTS[statement][0], period), response=e.response) from None
+    rows = pd.DataFrame(response.json())
+    rows = rows.reindex(columns=['date'] + STATEMENTS[statement][1])
+    rows.insert(0, 'ticker', ticker.upper())
+    rows.insert(1, 'statement', statement)
+    rows.insert(2, 'period', period)
+    return rows
+
+
+def long_frame(tickers):
+    '''
+    Downloads the statements of the tickers concurrently through the upstream client
+
+            Parameters:
+                    tickers (list): the tickers
+
+            Returns:
+                    frame (DataFrame): the rows of all the statements, in COLUMNS (the failed downloads are skipped)
+    '''
+    jobs = [(ticker, statement, period) for ticker in tickers for statement, period in DOWNLOADS]
+    with span('fmp_http', upstream=True):
+        results = upstream.client.map('fmp', download, jobs)
+    for job, result in zip(jobs, results):
+        if isinstance(result, Exception):
+            print ('Could not download %s %s of %s: %r' % (job[1], job[2], job[0], result))
+    frames = [result for result in results if isinstance(result, pd.DataFrame) and len(result)]
+    if not frames:
+        return pd.DataFrame(columns=COLUMNS)
+    frame = pd.concat(frames, ignore_index=True).reindex(columns=COLUMNS)
+    frame['date'] = pd.to_datetime(frame['date'])
+    numbers = COLUMNS[4:]
+    frame[numbers] = frame[numbers].apply(pd.to_numeric, errors='coerce')
+    return frame
+
+
+def fundamentals(frame):
+    '''
+    Returns the values of the DCF model of every ticker of a long frame, computed with groupbys
+
+            Parameters:
+                    frame (DataFrame): rows returned by long_frame
+
+            Returns:
+                    values (DataFrame): indexed by ticker, columns cash_flow (TTM free cash flow, or the last
+                    annual one), total_debt and cash_and_ST_investments of the last quarter
+    '''
+    frame = frame.sort_values(['ticker', 'date'], ascending=[True, False])
+    rows = frame.groupby(['statement', 'period'])
+    def part(statement, period):
+        if (statement, period) in rows.groups:
+            return rows.get_group((statement, period))
+        return frame.iloc[:0]
+
+    # sum of the last 4 quarters, only for the tickers which published 4 quarters
+    quarters = part('cashflow', 'quarter').groupby('ticker').head(4).groupby('ticker')['freeCashFlow']
+    ttm = quarters.sum().where(quarters.count() == 4)
+    annual = part('cashflow', 'annual').groupby('ticker')['freeCashFlow'].first()
+    balance = part('balancesheet', 'quarter').groupby('ticker')[['totalDebt', 'cashAndShortTermInvestments']].first()
+
+    values = pd.DataFrame({'cash_flow': ttm.combine_first(annual)})
+    values = values.join(balance, how='outer').rename(columns={'totalDebt': 'total_debt',
+                                                               'cashAndShortTermInvestments': 'cash_and_ST_investments'})
+    values.index.name = 'ticker'
+    return values.reindex(columns=['cash_flow', 'total_debt', 'cash_and_ST_investments'])
+
+
+def ingest(tickers, chunk=CHUNK):
+    '''
+    Downloads and reduces the fundamentals chunk by chunk, keeping them in the cache
+
+            Parameters:
+                    tickers (list): the tickers
+                    chunk (int): number of tickers downloaded together
+
+            Returns:
+                    values (generator): one DataFrame as returned by fundamentals per chunk
+    '''
+    for start in range(0, len(tickers), chunk):
+        values = fundamentals(long_frame(tickers[start:start + chunk]))
+        for ticker, row in zip(values.index, values.itertuples(index=False)):
+            if not row_missing(row):
+                cache.ticker_cache.put('fmp', ticker, tuple(row))
+        yield values
+
+
+def row_missing(row):
+    return any(pd.isna(value) for value in row)
+
+
+def statement_values(ticker):
+    '''
+    Returns the values of the last statements needed by the DCF model, like financials.statement_values
+
+            Parameters:
+                    ticker (str): the company ticker
+
+            Returns:
+                    cash_flow (float): TTM free cash flow
+                    total_debt (float): total debt of the last quarter
+                    cash_and_ST_investments (float): cash and short term investments of the last quarter
+    '''
+    ticker = ticker.upper()
+    def load():
+        values = next(ingest([ticker]))
+        if ticker not in values.index or row_missing(values.loc[ticker]):
+            raise KeyError('No financialmodelingprep statements for ' + ticker)
+        return tuple(values.loc[ticker])
+    return cache.ticker_cache.get('fmp', ticker, load)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fundamentals of a list of tickers from financialmodelingprep")
+    parser.add_argument('tickers', help="file with the tickers, '-' for the standard input")
+    parser.add_argument('--output', help="csv or parquet file (standard output by default)")
+    parser.add_argument('--chunk', type=int, default=CHUNK, help="number of tickers downloaded together")
+    args = parser.parse_args(argv)
+
+    import screener
+    text = sys.stdin.read() if args.tickers == '-' else open(args.tickers).read()
+    chunks = ingest(screener.read_tickers(text), args.chunk)
+    if args.output and args.output.endswith('.parquet'):
+        pd.concat(list(chunks)).to_parquet(args.output)
+        return
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    for i, values in enumerate(chunks):
+        values.to_csv(output, header=(i == 0))
+        output.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+'''
+gunicorn settings of the production server: gunicorn -c gunicorn.conf.py wsgi:app
+
+Each setting can be changed with an environment variable (TDLOG_BIND, TDLOG_WORKERS, TDLOG_THREADS).
+'''
+import multiprocessing
+import os
+
+bind = os.environ.get('TDLOG_BIND', '0.0.0.0:8000')
+#one process per core, each one serving several requests at once in threads (the pages mostly wait for the upstream)
+workers = int(os.environ.get('TDLOG_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('TDLOG_THREADS', 16))
+#the live price streams stay open: the threaded workers keep answering the heartbeat of the master meanwhile
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+#the application (and its schema) is loaded once by the master, the workers are forked from it
+preload_app = True
+#a few bcrypt threads per worker rather than one per core in each worker
+os.environ.setdefault('TDLOG_HASH_WORKERS', '2')
+
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    # the prefetcher starts with the worker rather than at its first request (one worker per host runs it)
+    import app
+    if app.app.config['PREFETCH']:
+        app.start_prefetcher_once()
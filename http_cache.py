@@ -0,0 +1,101 @@
+'''
+HTTP caching of the ticker pages: ETags derived from the version of the cached data,
+Cache-Control headers, 304 answers to conditional requests and gzip/brotli compression.
+'''
+import gzip
+import hashlib
+from functools import wraps
+
+from flask import request, make_response, session
+from flask_login import current_user
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#Cache-Control of the ticker pages and of the api (seconds)
+MAX_AGE = 60
+STALE_WHILE_REVALIDATE = 600
+
+#responses smaller than this (in bytes) are not compressed
+MIN_COMPRESS_SIZE = 500
+COMPRESSED_TYPES = ('text/html', 'application/json', 'text/css', 'application/javascript', 'text/plain')
+
+
+def data_etag(symbol):
+    '''
+    Returns the ETag of a response about a ticker: it changes with the url, the user (and the
+    session 'page_version', bumped by the views changing what the user's pages show), the last
+    price bar and the last download of the fundamentals
+
+            Parameters:
+                    symbol (str): the company ticker
+
+            Returns:
+                    etag (str): the ETag value
+    '''
+    import price_history
+    from store import store
+    version = (request.full_path,
+               current_user.get_id() if current_user.is_authenticated else None,
+               session.get('page_version'),
+               str(price_history.history.last_date(symbol)),
+               store.as_of(symbol))
+    return hashlib.sha1(repr(version).encode('utf-8')).hexdigest()[:20]
+
+
+def cache_headers(response, etag):
+    '''
+    Sets the ETag and the Cache-Control of a response (private when a user is logged in)
+    '''
+    response.set_etag(etag, weak=True)
+    response.cache_control.max_age = MAX_AGE
+    response.cache_control['stale-while-revalidate'] = str(STALE_WHILE_REVALIDATE)
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.vary.add('Cookie')
+    return response
+
+
+def conditional(view):
+    '''
+    Decorates a view taking a symbol: answers 304 Not Modified when the client has the current
+    version, without running the view if the price history is fresh, and adds the caching headers
+    '''
+    @wraps(view)
+    def wrapper(symbol, **kwargs):
+        import price_history
+        if request.method != 'GET':
+            return view(symbol, **kwargs)
+        symbol_key = symbol.upper()
+        if price_history.history.is_fresh(symbol_key) and request.if_none_match.contains_weak(data_etag(symbol_key)):
+            return cache_headers(make_response('', 304), data_etag(symbol_key))
+        response = make_response(view(symbol, **kwargs))
+        if response.status_code != 200:
+            return response
+        cache_headers(response, data_etag(symbol_key))
+        return response.make_conditional(request)
+    return wrapper
+
+
+def compress(response):
+    '''
+    Compresses a response with brotli (if installed) or gzip when the client accepts it
+    '''
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSED_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli is not None else ['gzip'])
+    data = response.get_data()
+    if encoding is None or len(data) < MIN_COMPRESS_SIZE:
+        return response
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=5))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,130 @@
+'''
+Live prices: one shared thread polls the quotes of all the watched tickers with a single
+upstream request per interval and pushes the changed prices to the subscribers
+(the Server-Sent Events streams of the ticker pages).
+'''
+import queue
+import threading
+import time
+
+import pandas as pd
+import yfinance as yf
+
+from metrics import span
+import upstream
+
+#time (in seconds) between two polls of the quotes
+INTERVAL = 15
+#updates kept for a subscriber which does not read them, when full only the last price is kept
+QUEUE_SIZE = 100
+
+
+def last_quotes(symbols):
+    '''
+    Returns the last price of each ticker, from one yf.download of the intraday bars
+
+            Parameters:
+                    symbols (list): the tickers
+
+            Returns:
+                    quotes (dict): ticker -> (date (str), price (float)), without the tickers with no price
+    '''
+    with span('yfinance_quotes', upstream=True):
+        data = upstream.client.run('yahoo', lambda: yf.download(symbols, period='1d', interval='1m', progress=False))
+    close = data['Close']
+    if isinstance(close, pd.Series):
+        close = close.to_frame(symbols[0])
+    quotes = {}
+    for symbol in symbols:
+        if symbol not in close:
+            continue
+        series = close[symbol].dropna()
+        if len(series):
+            quotes[symbol] = (str(series.index[-1].date()), round(float(series.iloc[-1]), 2))
+    return quotes
+
+
+class Poller(threading.Thread):
+    '''
+    Daemon thread polling the quotes of the subscribed tickers every interval, started by the first subscription
+
+            Parameters:
+                    interval (float): seconds between two polls
+    '''
+
+    def __init__(self, interval=INTERVAL):
+        super().__init__(name='live-poller', daemon=True)
+        self.interval = interval
+        self.subscribers = {}
+        self.quotes = {}
+        self._lock = threading.Lock()
+        self.watched = threading.Event()
+        self.stopped = threading.Event()
+
+    def subscribe(self, symbol):
+        '''
+        Returns the queue receiving the (date, price) updates of a ticker, starting with the last known one
+        '''
+        symbol = symbol.upper()
+        updates = queue.Queue(QUEUE_SIZE)
+        with self._lock:
+            self.subscribers.setdefault(symbol, set()).add(updates)
+            if symbol in self.quotes:
+                updates.put_nowait(self.quotes[symbol])
+            if not self.is_alive() and not self.stopped.is_set():
+                self.start()
+        self.watched.set()
+        return updates
+
+    def unsubscribe(self, symbol, updates):
+        symbol = symbol.upper()
+        with self._lock:
+            self.subscribers.get(symbol, set()).discard(updates)
+            if not self.subscribers.get(symbol):
+                self.subscribers.pop(symbol, None)
+                self.quotes.pop(symbol, None)
+            if not self.subscribers:
+                self.watched.clear()
+
+    def publish(self, symbol, quote):
+        with self._lock:
+            subscribers = list(self.subscribers.get(symbol, ()))
+            if subscribers:
+                self.quotes[symbol] = quote
+        for updates in subscribers:
+            try:
+                updates.put_nowait(quote)
+            except queue.Full:
+                #the subscriber only needs the last price
+                with updates.mutex:
+                    updates.queue.clear()
+                updates.put_nowait(quote)
+
+    def poll(self):
+        '''
+        Downloads the quotes of all the watched tickers and publishes the ones which changed
+        '''
+        with self._lock:
+            symbols = sorted(self.subscribers)
+        if not symbols:
+            return
+        for symbol, quote in last_quotes(symbols).items():
+            if self.quotes.get(symbol) != quote:
+                self.publish(symbol, quote)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.watched.wait()
+            start = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                print ('Could not poll the quotes: ' + repr(e))
+            self.stopped.wait(max(self.interval - (time.monotonic() - start), 0))
+
+    def stop(self):
+        self.stopped.set()
+        self.watched.set()
+
+
+poller = Poller()
@@ -0,0 +1,120 @@
+'''
+Timing spans of the stages of a request (upstream downloads, parsing, DCF, rendering)
+and counters, exposed in the Prometheus text format and as a Server-Timing header.
+'''
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+#upper bounds (in seconds) of the buckets of the duration histograms
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+#spans of the current request, None outside of a request
+_timings = contextvars.ContextVar('timings', default=None)
+
+
+def format_labels(labels):
+    return '{' + ','.join('%s="%s"' % (k, v) for k, v in labels) + '}' if labels else ''
+
+
+class Registry:
+    '''
+    Thread-safe counters and duration histograms, identified by a name and labels
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def observe(self, name, seconds, labels=()):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = {'buckets': [0]*len(BUCKETS), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def render(self, gauges=()):
+        '''
+        Returns the counters, histograms and extra gauges in the Prometheus text format
+
+            Parameters:
+                    gauges (iterable): (name, labels, value) of values read at scrape time
+
+            Returns:
+                    text (str): the exposition text
+        '''
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append('# TYPE %s counter' % name)
+                lines += ['%s%s %s' % (name, format_labels(labels), value)
+                          for (n, labels), value in sorted(self.counters.items()) if n == name]
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append('# TYPE %s histogram' % name)
+                for (n, labels), histogram in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(BUCKETS, histogram['buckets']):
+                        lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', bound),)), count))
+                    lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', '+Inf'),)), histogram['count']))
+                    lines.append('%s_sum%s %f' % (name, format_labels(labels), histogram['sum']))
+                    lines.append('%s_count%s %d' % (name, format_labels(labels), histogram['count']))
+        for name in sorted({name for name, _, _ in gauges}):
+            lines.append('# TYPE %s gauge' % name)
+            lines += ['%s%s %s' % (name, format_labels(labels), value) for n, labels, value in gauges if n == name]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+@contextmanager
+def span(stage, upstream=False):
+    '''
+    Times a stage: the duration goes to the tdlog_stage_seconds histogram and to the timings
+    of the current request; the errors of upstream stages are counted
+
+            Parameters:
+                    stage (str): name of the stage ('finviz_http', 'dcf', 'render'...)
+                    upstream (bool): True for the downloads from Yahoo Finance and Finviz
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if upstream:
+            registry.inc('tdlog_upstream_errors_total', (('stage', stage),))
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        registry.observe('tdlog_stage_seconds', duration, (('stage', stage),))
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((stage, duration))
+
+
+def start_request():
+    '''
+    Starts collecting the spans of a request (the executor threads share them through copy_context)
+    '''
+    _timings.set([])
+
+
+def server_timing():
+    '''
+    Returns the Server-Timing header value of the current request: total duration of each stage in ms
+    '''
+    totals = {}
+    for stage, duration in _timings.get() or ():
+        totals[stage] = totals.get(stage, 0) + duration
+    return ', '.join('%s;dur=%.1f' % (stage, duration*1000) for stage, duration in totals.items())
@@ -0,0 +1,176 @@
+'''
+Offline stand-in for Yahoo Finance and Finviz, answering from the fixtures with a configurable
+latency. The fixtures are synthetic: made-up prices, statements and metrics in the format of the
+Finviz pages and of the yfinance data, not market data. The app uses it when TDLOG_OFFLINE is set:
+
+    TDLOG_OFFLINE=1 TDLOG_OFFLINE_LATENCY=0.2 flask run
+
+Recording the real data of new tickers as fixtures needs internet access:
+
+    python offline.py record TICKER [TICKER ...]
+'''
+import json
+import os
+import sys
+import time
+from urllib.parse import urlparse, parse_qs
+
+import pandas as pd
+import requests
+import yfinance as yf
+
+import financials as fin
+import price_history
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+#latency (in seconds) added to each answer, like a network round-trip
+LATENCY = 0.05
+
+#time zone of the histories, as returned by yfinance
+TIME_ZONE = 'America/New_York'
+
+STATEMENTS = ('cashflow', 'balancesheet')
+
+
+def fixture(*parts):
+    return os.path.join(FIXTURES, *parts)
+
+
+def tickers():
+    '''
+    Returns the tickers which have fixtures for both Finviz and yfinance
+    '''
+    finviz = {name[:-5] for name in os.listdir(fixture('finviz')) if name.endswith('.html')}
+    return sorted(finviz & set(os.listdir(fixture('yfinance'))))
+
+
+class OfflineTicker:
+    '''
+    Same accessors as yfinance.Ticker (info, history, cashflow, balancesheet), read from the fixtures
+
+            Parameters:
+                    ticker (str): the company ticker
+                    latency (float): seconds waited by each accessor
+    '''
+
+    def __init__(self, ticker, latency=None):
+        self.ticker = ticker.upper()
+        self.latency = LATENCY if latency is None else latency
+
+    def _path(self, name):
+        time.sleep(self.latency)
+        return fixture('yfinance', self.ticker, name)
+
+    @property
+    def info(self):
+        path = self._path('info.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _statement(self, name):
+        path = self._path(name + '.csv')
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        statement = pd.read_csv(path, index_col=0)
+        statement.columns = pd.to_datetime(statement.columns)
+        return statement
+
+    @property
+    def cashflow(self):
+        return self._statement('cashflow')
+
+    @property
+    def balancesheet(self):
+        return self._statement('balancesheet')
+
+    def history(self, period="1mo", start=None, **kwargs):
+        path = self._path('history.csv')
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=['Close'])
+        hist = pd.read_csv(path, index_col=0, parse_dates=True)
+        hist.index = hist.index.tz_localize(TIME_ZONE)
+        if start is not None:
+            return hist[hist.index >= pd.Timestamp(start, tz=TIME_ZONE)]
+        dates = hist.index.tz_localize(None).values.astype('datetime64[D]')
+        return hist.iloc[price_history.start_of(dates, period):]
+
+
+class OfflineResponse:
+    def __init__(self, content, status_code):
+        self.content = content
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError('HTTP %d' % self.status_code, response=self)
+
+
+class OfflineSession:
+    '''
+    Answers the Finviz quote page requests (session.get) with the pages of the fixtures
+    '''
+
+    def __init__(self, latency=None):
+        self.latency = LATENCY if latency is None else latency
+
+    def get(self, url, **kwargs):
+        time.sleep(self.latency)
+        ticker = parse_qs(urlparse(url).query).get('t', [''])[0].upper()
+        path = fixture('finviz', ticker + '.html')
+        if not os.path.exists(path):
+            return OfflineResponse(b'', 404)
+        with open(path, 'rb') as f:
+            return OfflineResponse(f.read(), 200)
+
+
+def download(tickers, period="1mo", latency=None, **kwargs):
+    '''
+    Same as yfinance.download: the closes of several tickers, in columns ('Close', ticker)
+    '''
+    time.sleep(LATENCY if latency is None else latency)
+    if isinstance(tickers, str):
+        tickers = tickers.split()
+    closes = {ticker.upper(): OfflineTicker(ticker, 0).history(period=period)['Close'] for ticker in tickers}
+    return pd.concat({'Close': pd.DataFrame(closes)}, axis=1)
+
+
+def install(latency=None):
+    '''
+    Replaces yfinance.Ticker, yfinance.download and the Finviz session by the offline stand-ins
+
+            Parameters:
+                    latency (float): seconds waited by each upstream call
+    '''
+    yf.Ticker = lambda ticker, *args, **kwargs: OfflineTicker(ticker, latency)
+    yf.download = lambda tickers, *args, **kwargs: download(tickers, *args, latency=latency, **kwargs)
+    fin.session = OfflineSession(latency)
+
+
+def record(ticker):
+    '''
+    Saves the current Finviz page and yfinance data of a ticker as fixtures (needs internet access)
+    '''
+    ticker = ticker.upper()
+    directory = fixture('yfinance', ticker)
+    os.makedirs(directory, exist_ok=True)
+    with open(fixture('finviz', ticker + '.html'), 'wb') as f:
+        f.write(fin.fetch_finviz_html(ticker))
+    acao = yf.Ticker(ticker)
+    with open(os.path.join(directory, 'info.json'), 'w') as f:
+        json.dump({k: acao.info.get(k) for k in ('symbol', 'shortName', 'longBusinessSummary', 'currentPrice', 'currency')}, f, indent=1)
+    hist = acao.history(period='max')[['Close']]
+    hist.index = hist.index.tz_localize(None).normalize()
+    hist.index.name = 'Date'
+    hist.to_csv(os.path.join(directory, 'history.csv'))
+    for name in STATEMENTS:
+        getattr(acao, name).to_csv(os.path.join(directory, name + '.csv'))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != 'record':
+        sys.exit(__doc__)
+    for ticker in sys.argv[2:]:
+        record(ticker)
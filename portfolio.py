@@ -0,0 +1,132 @@
+'''
+Data of the profile page: last price, fair value, margin of safety and sparkline of all
+the favorites, from one multi-ticker download and one batched valuation.
+'''
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+import cache
+import financials as fin
+from metrics import span
+import upstream
+
+#period of the sparklines
+PERIOD = '1mo'
+#number of concurrent downloads of the fundamentals missing from the cache
+WORKERS = 16
+
+
+def closes(symbols, period=PERIOD):
+    '''
+    Returns the daily closes of all the tickers, from a single yf.download kept 5 minutes in the cache
+
+            Parameters:
+                    symbols (list): the tickers
+                    period (str): the period of the closes
+
+            Returns:
+                    closes (DataFrame): one column of closes per ticker
+    '''
+    def download():
+        with span('yfinance_download', upstream=True):
+            data = upstream.client.run('yahoo', lambda: yf.download(list(symbols), period=period, progress=False))
+        close = data['Close']
+        if isinstance(close, pd.Series):
+            close = close.to_frame(symbols[0])
+        return close
+    return cache.ticker_cache.get('history', ('download', tuple(symbols), period), download)
+
+
+def inputs(symbol):
+    '''
+    Returns the values needed to value a ticker (statements, shares, 5Y growth, discount rate), or None
+    '''
+    try:
+        finviz = cache.get_finviz_data(symbol)
+        #the metrics unknown to Finviz are '-'
+        if not all(isinstance(finviz.get(m), float) for m in fin.metric):
+            return None
+        discount_rate = fin.discount_rate(finviz)
+        if discount_rate is None:
+            return None
+        return fin.statement_values(cache.CachedTicker(symbol)) + (finviz['Shs Outstand'], finviz['EPS next 5Y'], discount_rate)
+    except Exception as e:
+        print ('Could not value ' + symbol + ': ' + repr(e))
+        return None
+
+
+def fair_values(symbols):
+    '''
+    Returns the fair value of each ticker: from the cache when warm, the others valued together
+
+            Parameters:
+                    symbols (list): the tickers
+
+            Returns:
+                    values (dict): ticker -> fair value (float) or "nan"
+    '''
+    values = {s: cache.ticker_cache.peek('fairvalue', s) for s in symbols}
+    missing = [s for s, value in values.items() if value is None]
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        rows = dict(zip(missing, pool.map(inputs, missing)))
+    valid = [s for s in missing if rows[s] is not None]
+    if valid:
+        columns = np.array([rows[s] for s in valid], dtype=float).T
+        for symbol, value in zip(valid, fin.fair_values(*columns)):
+            values[symbol] = round(float(value), 2)
+            cache.ticker_cache.put('fairvalue', symbol, values[symbol])
+    return {s: "nan" if value is None or type(value) == str or not np.isfinite(value) else value
+            for s, value in values.items()}
+
+
+def sparkline(values, width=120, height=30):
+    '''
+    Returns the points of an SVG polyline drawing the values
+
+            Parameters:
+                    values (array): the closes, NaN values are skipped
+                    width, height (int): size of the drawing
+
+            Returns:
+                    points (str): "x,y x,y ..." coordinates
+    '''
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) < 2:
+        return ''
+    low, high = values.min(), values.max()
+    x = np.linspace(0, width, len(values))
+    y = height - (values - low)/((high - low) or 1)*height
+    return ' '.join('%.1f,%.1f' % point for point in zip(x, y))
+
+
+def holdings(symbols):
+    '''
+    Returns one row per ticker for the profile table
+
+            Parameters:
+                    symbols (list): the tickers
+
+            Returns:
+                    rows (list): dicts with ticker, price, fair_value, margin and sparkline
+    '''
+    if not symbols:
+        return []
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        prices = pool.submit(closes, symbols)
+        values = pool.submit(fair_values, symbols)
+        prices, values = prices.result(), values.result()
+    rows = []
+    for symbol in symbols:
+        series = prices[symbol].dropna() if symbol in prices else pd.Series(dtype=float)
+        price = round(float(series.iloc[-1]), 2) if len(series) else None
+        value = values[symbol]
+        margin = None
+        if price is not None and type(value) != str and value > 0:
+            margin = round((1 - price/value)*100, 2)
+        rows.append({'ticker': symbol, 'price': price, 'fair_value': value, 'margin': margin,
+                     'sparkline': sparkline(series.to_numpy())})
+    return rows
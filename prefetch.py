@@ -0,0 +1,122 @@
+'''
+Background warming of the data of the favorited and most viewed tickers: price history,
+fundamentals and fair value, spread under a global budget of upstream requests.
+'''
+import threading
+import time
+
+import cache
+import price_history
+
+#time (in seconds) between two rounds of prefetching
+INTERVAL = 10*60
+#upstream requests per second allowed to the prefetching
+RATE = 0.5
+#number of most viewed tickers prefetched in addition to the favorites
+TOP_VIEWED = 20
+
+
+class RateBudget:
+    '''
+    Token bucket: acquire() waits until a request is allowed by the rate
+
+            Parameters:
+                    rate (float): requests per second
+                    burst (int): number of requests allowed at once after a pause
+    '''
+
+    def __init__(self, rate=RATE, burst=5):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last)*self.rate)
+            self.last = now
+            self.tokens -= 1
+            wait = -self.tokens/self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def record_view(symbol):
+    '''
+    Counts a view of a ticker page in the store, so that the most viewed tickers are ranked across all the workers
+    '''
+    from store import store
+    try:
+        store.add_view(symbol)
+    except Exception as e:
+        print ('Could not count the view of ' + symbol + ': ' + repr(e))
+
+def most_viewed(n=TOP_VIEWED):
+    from store import store
+    try:
+        return store.most_viewed(n)
+    except Exception as e:
+        print ('Could not rank the views: ' + repr(e))
+        return []
+
+
+class Prefetcher(threading.Thread):
+    '''
+    Daemon thread warming the caches of the favorited and most viewed tickers every interval
+
+            Parameters:
+                    favorites (function): returns the favorited tickers
+                    value (function): computes (and caches) the fair value of a CachedTicker and its ticker
+                    interval (float): seconds between two rounds
+                    budget (RateBudget): budget of upstream requests
+    '''
+
+    def __init__(self, favorites, value, interval=INTERVAL, budget=None):
+        super().__init__(name='prefetcher', daemon=True)
+        self.favorites = favorites
+        self.value = value
+        self.interval = interval
+        self.budget = budget if budget is not None else RateBudget()
+        self.stopped = threading.Event()
+
+    def targets(self):
+        '''
+        Returns the tickers to warm: the favorites first, then the most viewed
+        '''
+        symbols = [s.upper() for s in self.favorites()]
+        return symbols + [s for s in most_viewed() if s not in symbols]
+
+    def warm(self, symbol):
+        '''
+        Loads the price history, the fundamentals and the fair value of a ticker; the steps which are
+        not already warm in memory wait for the budget
+        '''
+        acao = cache.CachedTicker(symbol)
+        def cached(kind):
+            return lambda: cache.ticker_cache.peek(kind, acao.ticker) is not None
+        steps = ((lambda: price_history.history.is_fresh(acao.ticker), lambda: price_history.history.closes(acao)),
+                 (cached('info'), lambda: acao.info),
+                 (cached('cashflow'), lambda: acao.cashflow),
+                 (cached('balancesheet'), lambda: acao.balancesheet),
+                 (cached('finviz'), lambda: cache.get_finviz_data(acao.ticker)),
+                 (cached('fairvalue'), lambda: self.value(acao, acao.ticker)))
+        for warm, load in steps:
+            if not warm():
+                self.budget.acquire()
+                load()
+
+    def run(self):
+        while not self.stopped.is_set():
+            for symbol in self.targets():
+                if self.stopped.is_set():
+                    break
+                try:
+                    self.warm(symbol)
+                except Exception as e:
+                    print ('Could not prefetch ' + symbol + ': ' + repr(e))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,246 @@
+'''
+Local cache of the daily closes of each ticker, stored as two append-only columns
+(dates as datetime64[D] and closes as float32) memory-mapped from disk.
+'''
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: only the development server, in one process
+    fcntl = None
+
+import cache
+from metrics import span
+from store import DATA_DIRECTORY
+import upstream
+
+DIRECTORY = os.path.join(DATA_DIRECTORY, 'prices')
+
+#minimum time (in seconds) between two downloads of the new bars of a ticker
+REFRESH = 5*60
+
+#number of points of the graph sent to the browser (about 2 pixels per point on the 800px canvas)
+MAX_POINTS = 400
+
+EMPTY = (np.array([], dtype='datetime64[D]'), np.array([], dtype=np.float32))
+
+
+def to_days(index):
+    '''
+    Converts the index of a yfinance history to an array of days
+
+            Parameters:
+                    index (DatetimeIndex): index of the history, with or without time zone
+
+            Returns:
+                    days (array): the dates as datetime64[D]
+    '''
+    if getattr(index, 'tz', None) is not None:
+        index = index.tz_localize(None)
+    return np.asarray(index.values, dtype='datetime64[D]')
+
+
+def start_of(dates, interval):
+    '''
+    Returns the position of the first bar of an interval ('5d', '1mo', '6mo', '1y', 'Max'...)
+
+            Parameters:
+                    dates (array): the sorted dates of the bars
+                    interval (str): the time interval of the graph
+
+            Returns:
+                    start (int): position of the first bar to show
+    '''
+    match = re.fullmatch(r'(\d+)(d|mo|y)', interval.lower())
+    if not len(dates) or match is None:
+        return 0
+    n, unit = int(match.group(1)), match.group(2)
+    # like yfinance, '5d' means the last 5 trading days
+    if unit == 'd':
+        return max(len(dates) - n, 0)
+    offset = pd.DateOffset(months=n) if unit == 'mo' else pd.DateOffset(years=n)
+    first = np.datetime64((pd.Timestamp(dates[-1]) - offset).date())
+    return int(np.searchsorted(dates, first, side='left'))
+
+
+def downsample(dates, closes, target=MAX_POINTS):
+    '''
+    Reduces a series to about target points keeping its shape: the first and last points,
+    and the minimum and maximum of each of target/2 buckets of consecutive points
+
+            Parameters:
+                    dates (array): dates of the points
+                    closes (array): values of the points
+                    target (int): maximum number of points returned
+
+            Returns:
+                    dates (array): dates of the kept points, in order
+                    closes (array): values of the kept points
+    '''
+    n = len(closes)
+    if n <= target or target < 4:
+        return dates, closes
+    buckets = (target - 2)//2
+    inner = closes[1:-1]
+    # bucket of each inner point, non decreasing
+    bucket = np.arange(n - 2) * buckets // (n - 2)
+    # points sorted by bucket, then by value: the first of each bucket is its minimum and the last its maximum
+    order = np.lexsort((inner, bucket))
+    first = np.searchsorted(bucket, np.arange(buckets), side='left')
+    last = np.searchsorted(bucket, np.arange(buckets), side='right') - 1
+    keep = np.unique(np.concatenate(([0], order[first] + 1, order[last] + 1, [n - 1])))
+    return dates[keep], closes[keep]
+
+
+class PriceHistory:
+    '''
+    Daily closes of each ticker on disk, completed with only the bars after the last stored one
+
+            Parameters:
+                    directory (str): folder of the files <TICKER>.dates and <TICKER>.close
+                    refresh (float): minimum time in seconds between two downloads for a ticker
+    '''
+
+    def __init__(self, directory=DIRECTORY, refresh=REFRESH):
+        self.directory = directory
+        self.refresh = refresh
+        self._locks = {}
+        self._lock = threading.Lock()
+        # last bar of each ticker, which can still change (trading day not over), kept in memory
+        self._live = {}
+        self._checked = {}
+
+    def _paths(self, ticker):
+        name = os.path.join(self.directory, ticker.upper())
+        return name + '.dates', name + '.close'
+
+    def _ticker_lock(self, ticker):
+        with self._lock:
+            return self._locks.setdefault(ticker, threading.Lock())
+
+    @contextmanager
+    def _file_lock(self, ticker):
+        '''
+        Holds the lock file of a ticker, so that only one worker process downloads and appends its bars at a time
+        '''
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ticker.upper() + '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def stored(self, ticker):
+        '''
+        Returns the bars stored on disk for a ticker, memory-mapped (read only)
+
+            Returns:
+                    dates (array): datetime64[D] dates
+                    closes (array): float32 closes
+        '''
+        dates_path, close_path = self._paths(ticker)
+        if not os.path.exists(close_path) or os.path.getsize(close_path) == 0:
+            return EMPTY
+        closes = np.memmap(close_path, dtype=np.float32, mode='r')
+        dates = np.memmap(dates_path, dtype='datetime64[D]', mode='r', shape=closes.shape)
+        return dates, closes
+
+    def is_fresh(self, ticker):
+        '''
+        Returns True if the new bars of a ticker were downloaded less than refresh seconds ago
+        '''
+        return time.monotonic() - self._checked.get(ticker.upper(), -self.refresh) < self.refresh
+
+    def last_date(self, ticker):
+        '''
+        Returns the date of the last known bar of a ticker without downloading anything, or None
+        '''
+        live_dates, _ = self._live.get(ticker.upper(), EMPTY)
+        if len(live_dates):
+            return live_dates[-1]
+        dates, _ = self.stored(ticker)
+        return dates[-1] if len(dates) else None
+
+    def update(self, acao):
+        '''
+        Downloads the bars after the last stored one and appends the completed ones to the files
+
+            Parameters:
+                    acao (CachedTicker): target company
+        '''
+        ticker = acao.ticker
+        with self._ticker_lock(ticker), self._file_lock(ticker):
+            if self.is_fresh(ticker):
+                return
+            # another worker checked the new bars less than refresh seconds ago
+            live = cache.ticker_cache.peek('bars', ticker)
+            if live is not None:
+                self._live[ticker] = live
+                self._checked[ticker] = time.monotonic()
+                return
+            dates, closes = self.stored(ticker)
+            with span('yfinance_history', upstream=True):
+                if len(dates):
+                    hist = upstream.client.run('yahoo', lambda: acao.upstream().history(start=str(dates[-1] + 1)))
+                else:
+                    hist = upstream.client.run('yahoo', lambda: acao.upstream().history(period='max'))
+            self._checked[ticker] = time.monotonic()
+            if hist is not None and not hist.empty:
+                self._append(ticker, dates, hist)
+            cache.ticker_cache.put('bars', ticker, self._live.get(ticker, EMPTY))
+
+    def _append(self, ticker, dates, hist):
+        new_dates = to_days(hist.index)
+        new_closes = hist['Close'].to_numpy(dtype=np.float32)
+        keep = new_dates > dates[-1] if len(dates) else np.ones(len(new_dates), dtype=bool)
+        new_dates, new_closes = new_dates[keep], new_closes[keep]
+        if not len(new_dates):
+            return
+        # only the last bar can still change: the others are appended to the files
+        os.makedirs(self.directory, exist_ok=True)
+        dates_path, close_path = self._paths(ticker)
+        with open(dates_path, 'ab') as f:
+            new_dates[:-1].tofile(f)
+        with open(close_path, 'ab') as f:
+            new_closes[:-1].tofile(f)
+        self._live[ticker] = (new_dates[-1:], new_closes[-1:])
+
+    def closes(self, acao, interval="5d"):
+        '''
+        Returns the daily closes of an interval, served from the files after downloading only the new bars
+
+            Parameters:
+                    acao (CachedTicker): target company
+                    interval (str): the time interval of the graph
+
+            Returns:
+                    dates (array): datetime64[D] dates
+                    closes (array): float32 closes
+        '''
+        try:
+            self.update(acao)
+        except Exception as e:
+            # the stored closes are served when the upstream is down
+            if not len(self.stored(acao.ticker)[0]):
+                raise
+            print ('Serving stale history of ' + acao.ticker + ': ' + repr(e))
+        dates, closes = self.stored(acao.ticker)
+        live_dates, live_closes = self._live.get(acao.ticker, EMPTY)
+        if len(live_dates) and len(dates) and live_dates[0] <= dates[-1]:
+            live_dates, live_closes = EMPTY
+        dates = np.concatenate([dates, live_dates])
+        closes = np.concatenate([closes, live_closes])
+        start = start_of(dates, interval)
+        return dates[start:], closes[start:]
+
+
+history = PriceHistory()
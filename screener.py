@@ -0,0 +1,202 @@
+'''
+Values a list of tickers with the DCF model and streams the results as they are ready.
+
+Usage: python screener.py TICKERS_FILE [--workers N] [--chunk N] [--source yfinance|fmp] [--risk table|capm]
+'''
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+import numpy as np
+
+import financials as fin
+import cache
+
+#maximum number of tickers of one screening
+MAX_TICKERS = 5000
+#number of concurrent downloads
+FETCH_WORKERS = 16
+#number of companies valued together by a process
+CHUNK = 50
+#number of processes parsing and valuing the chunks (in each server worker)
+PROCESSES = int(os.environ.get('TDLOG_SCREEN_PROCESSES', min(4, os.cpu_count() or 1)))
+
+_processes = None
+_processes_lock = threading.Lock()
+
+def read_tickers(text, limit=MAX_TICKERS):
+    '''
+    Returns the tickers found in a text (one per line, or separated by spaces, commas or semicolons)
+
+            Parameters:
+                    text (str): content of the form or of the uploaded file
+                    limit (int): maximum number of tickers
+
+            Returns:
+                    tickers (list): the distinct tickers in upper case, in their original order
+    '''
+    tickers = []
+    seen = set()
+    for ticker in re.split(r'[\s,;]+', text.upper()):
+        if ticker and ticker not in seen:
+            seen.add(ticker)
+            tickers.append(ticker)
+    return tickers[:limit]
+
+def fetch(ticker, source=None):
+    '''
+    Returns what is needed to value a ticker: the Finviz metrics and the last statements, from the caches and the store when known
+
+            Parameters:
+                    ticker (str): the company ticker
+                    source (str): source of the statements, 'yfinance' or 'fmp'
+
+            Returns:
+                    row (tuple): ticker, Finviz metrics and statement values (or the error message)
+    '''
+    try:
+        finviz = cache.get_finviz_data(ticker)
+        statements = fin.statement_values(cache.CachedTicker(ticker), source)
+        return ticker, finviz, statements, None
+    except Exception as e:
+        return ticker, None, None, repr(e)
+
+def value_chunk(rows, model=None):
+    '''
+    Values a chunk of companies with one batched DCF computation
+
+            Parameters:
+                    rows (list): tuples returned by fetch
+                    model (str): model of the discount rate, 'table' or 'capm' (financials.RISK_MODEL by default)
+
+            Returns:
+                    results (list): one dict per ticker with its price, fair value and margin of safety, or its error
+    '''
+    results = []
+    valid = []
+    for ticker, finviz, statements, error in rows:
+        if error is not None:
+            results.append({'ticker': ticker, 'error': error})
+            continue
+        numbers = [finviz.get(m) for m in fin.metric]
+        if not all(isinstance(n, float) for n in numbers):
+            results.append({'ticker': ticker, 'error': 'missing Finviz metrics'})
+            continue
+        valid.append((ticker, finviz.get('Name', ''), finviz, statements))
+
+    if valid:
+        columns = np.array([statements + (finviz['Shs Outstand'], finviz['EPS next 5Y'], finviz['Beta'], finviz['Price'])
+                            for ticker, name, finviz, statements in valid], dtype=float)
+        cash_flow, total_debt, cash, shares, growth_5Y, betas, prices = columns.T
+        rates = fin.discount_rates(betas, model)
+        values = fin.fair_values(cash_flow, total_debt, cash, shares, growth_5Y, rates)
+        for (ticker, name, finviz, statements), price, value, rate in zip(valid, prices, values, rates):
+            # no margin of safety without a positive fair value
+            margin = (1 - price/value)*100 if np.isfinite(value) and value > 0 else np.nan
+            results.append({'ticker': ticker,
+                            'name': name,
+                            'price': round(float(price), 2),
+                            'fair_value': round(float(value), 2) if np.isfinite(value) else None,
+                            'margin': round(float(margin), 2) if np.isfinite(margin) else None,
+                            'discount_rate': round(float(rate), 2)})
+    return results
+
+def processes():
+    '''
+    Returns the process pool doing the valuation, created once by the first screening of the process; its
+    processes are not forked from the threaded server (a lock held by another thread would stay locked in them)
+    '''
+    global _processes
+    with _processes_lock:
+        if _processes is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _processes = ProcessPoolExecutor(max_workers=PROCESSES, mp_context=multiprocessing.get_context(method))
+        return _processes
+
+def screen(tickers, workers=FETCH_WORKERS, chunk=CHUNK, source=None, model=None):
+    '''
+    Values tickers and yields the results chunk by chunk, as soon as each chunk is valued
+
+            Parameters:
+                    tickers (list): the tickers to value
+                    workers (int): number of concurrent downloads
+                    chunk (int): number of companies sent together to the process pool
+                    source (str): source of the statements, 'yfinance' or 'fmp' (financials.SOURCE by default)
+                    model (str): model of the discount rate, 'table' or 'capm' (financials.RISK_MODEL by default)
+
+            Returns:
+                    results (generator): lists of dicts as returned by value_chunk
+    '''
+    if (source or fin.SOURCE) == 'fmp':
+        # the statements of all the tickers are downloaded and reduced together first
+        import fmp
+        for values in fmp.ingest(tickers):
+            pass
+    pool = processes()
+    pending = set()
+    batch = []
+    threads = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for future in as_completed([threads.submit(fetch, t, source) for t in tickers]):
+            batch.append(future.result())
+            if len(batch) >= chunk:
+                pending.add(pool.submit(value_chunk, batch, model))
+                batch = []
+            done = {p for p in pending if p.done()}
+            for p in done:
+                yield p.result()
+            pending -= done
+        if batch:
+            pending.add(pool.submit(value_chunk, batch, model))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for p in done:
+                yield p.result()
+    finally:
+        #when the client is gone (the generator is closed), the downloads and chunks not started are dropped
+        threads.shutdown(wait=False, cancel_futures=True)
+        for p in pending:
+            p.cancel()
+
+def sort_key(row):
+    '''
+    Sorts the results by decreasing margin of safety, the companies without a margin and the errors last
+    '''
+    return -row['margin'] if row.get('margin') is not None else float('inf')
+
+def format_row(row):
+    fair_value = '%12.2f' % row['fair_value'] if row['fair_value'] is not None else '%12s' % 'n/a'
+    margin = '%9.2f%%' % row['margin'] if row['margin'] is not None else '%10s' % 'n/a'
+    return '%-8s %10.2f %s %s' % (row['ticker'], row['price'], fair_value, margin)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Values a list of tickers with the DCF model")
+    parser.add_argument('tickers', help="file with the tickers, '-' for the standard input")
+    parser.add_argument('--workers', type=int, default=FETCH_WORKERS, help="number of concurrent downloads")
+    parser.add_argument('--chunk', type=int, default=CHUNK, help="number of companies valued together")
+    parser.add_argument('--source', choices=('yfinance', 'fmp'), help="source of the statements")
+    parser.add_argument('--risk', choices=fin.RISK_MODELS, help="model of the discount rate")
+    args = parser.parse_args(argv)
+
+    text = sys.stdin.read() if args.tickers == '-' else open(args.tickers).read()
+    results = []
+    for rows in screen(read_tickers(text), args.workers, args.chunk, args.source, args.risk):
+        for row in rows:
+            if 'error' in row:
+                print('%-8s %s' % (row['ticker'], row['error']), file=sys.stderr)
+            else:
+                print(format_row(row), flush=True)
+        results.extend(rows)
+
+    print('\n%-8s %10s %12s %10s' % ('Ticker', 'Price', 'Fair value', 'Margin'))
+    for row in sorted(results, key=sort_key):
+        if 'error' not in row:
+            print(format_row(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+'''
+Cache shared by the processes of one host (the gunicorn workers), behind the cache of each process:
+a value downloaded by one worker is read by the others instead of being downloaded again, and only
+one worker at a time downloads a missing value (the others wait for it).
+
+TDLOG_CACHE_URL selects the backend: SQLite in WAL mode by default (cache.db in the data folder),
+redis://host:port/db for a local Redis (needs the redis package), "none" to disable it.
+'''
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+#same folder as store.DATA_DIRECTORY, without importing yfinance
+DATABASE = os.path.join(os.environ.get('TDLOG_DATA', os.path.dirname(os.path.abspath(__file__))), 'cache.db')
+URL = os.environ.get('TDLOG_CACHE_URL', 'sqlite:///' + DATABASE)
+
+#seconds an expired value is kept after its expiry, served when the upstream is down
+KEEP_STALE = 24*3600
+#seconds a worker may download a value before the others stop waiting for it
+LEASE = 20
+#seconds between two reads of the workers waiting for a value
+POLL = 0.05
+#number of writes between two purges of the old values (SQLite)
+PURGE_EVERY = 1000
+
+
+class SQLiteBackend:
+    '''
+    Values and leases in a SQLite file opened in WAL mode, so that the readers never wait for the writer
+
+            Parameters:
+                    path (str): the SQLite file
+    '''
+
+    def __init__(self, path=DATABASE):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    def connection(self):
+        '''
+        Returns the connection of the current thread, opened again in a forked worker
+        '''
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, purge_at REAL NOT NULL, payload BLOB NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires REAL NOT NULL)')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return self._local.connection
+
+    def get(self, key):
+        row = self.connection().execute('SELECT payload FROM cache WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key, payload, keep):
+        connection = self.connection()
+        now = time.time()
+        connection.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)', (key, now + keep, payload))
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            connection.execute('DELETE FROM cache WHERE purge_at < ?', (now,))
+            connection.execute('DELETE FROM leases WHERE expires < ?', (now,))
+
+    def acquire(self, key, seconds):
+        connection = self.connection()
+        now = time.time()
+        connection.execute('DELETE FROM leases WHERE key = ? AND expires < ?', (key, now))
+        return connection.execute('INSERT OR IGNORE INTO leases VALUES (?, ?)', (key, now + seconds)).rowcount == 1
+
+    def release(self, key):
+        self.connection().execute('DELETE FROM leases WHERE key = ?', (key,))
+
+
+class RedisBackend:
+    '''
+    Values and leases in Redis, which expires them itself
+
+            Parameters:
+                    url (str): redis://host:port/db
+    '''
+
+    def __init__(self, url):
+        import redis
+        # the pool of redis-py opens new connections in a forked worker
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, payload, keep):
+        self.client.set(key, payload, ex=max(int(keep), 1))
+
+    def acquire(self, key, seconds):
+        return bool(self.client.set('lease:' + key, os.getpid(), nx=True, ex=seconds))
+
+    def release(self, key):
+        self.client.delete('lease:' + key)
+
+
+class SharedCache:
+    '''
+    Pickled values with their expiry time, stored in a backend; the errors of the backend are
+    printed and treated as misses, so that the requests never fail because of the shared cache
+
+            Parameters:
+                    backend (SQLiteBackend or RedisBackend): where the values are stored
+                    keep_stale (float): seconds an expired value is kept
+                    lease (float): seconds a worker may download a value before the others stop waiting
+    '''
+
+    def __init__(self, backend, keep_stale=KEEP_STALE, lease=LEASE):
+        self.backend = backend
+        self.keep_stale = keep_stale
+        self.lease = lease
+
+    @staticmethod
+    def name(kind, key):
+        return kind + ':' + repr(key)
+
+    def get(self, kind, key):
+        '''
+        Returns the stored value of (kind, key), even expired, and its expiry time (seconds since the epoch), or (None, None)
+        '''
+        try:
+            payload = self.backend.get(self.name(kind, key))
+            if payload is None:
+                return None, None
+            expires, value = pickle.loads(payload)
+            return value, expires
+        except Exception as e:
+            print ('Shared cache unavailable: ' + repr(e))
+            return None, None
+
+    def put(self, kind, key, value, expires):
+        try:
+            payload = pickle.dumps((expires, value), protocol=pickle.HIGHEST_PROTOCOL)
+            self.backend.set(self.name(kind, key), payload, expires - time.time() + self.keep_stale)
+        except Exception as e:
+            print ('Could not share ' + kind + ' of ' + repr(key) + ': ' + repr(e))
+
+    def load(self, kind, key, seconds, loader):
+        '''
+        Returns the value of (kind, key) stored by another process if it is fresh, otherwise calls loader()
+        in only one process at a time and stores its value
+
+            Parameters:
+                    kind (str): kind of data
+                    key (hashable): identifies the value inside its kind
+                    seconds (float): time to live of a loaded value
+                    loader (function): downloads the value
+
+            Returns:
+                    value (object): the value
+                    expires (float): its expiry time (seconds since the epoch)
+        '''
+        name = self.name(kind, key)
+        deadline = time.monotonic() + self.lease
+        while True:
+            value, expires = self.get(kind, key)
+            if value is not None and expires > time.time():
+                return value, expires
+            try:
+                leased = self.backend.acquire(name, self.lease)
+            except Exception as e:
+                print ('Shared cache unavailable: ' + repr(e))
+                leased = False
+                break
+            # the lease of a worker which is stuck or died expires: the value is downloaded anyway
+            if leased or time.monotonic() > deadline:
+                break
+            time.sleep(POLL)
+        try:
+            value = loader()
+            expires = time.time() + seconds
+            if value is not None:
+                self.put(kind, key, value, expires)
+            return value, expires
+        finally:
+            if leased:
+                try:
+                    self.backend.release(name)
+                except Exception as e:
+                    print ('Shared cache unavailable: ' + repr(e))
+
+
+def from_url(url=URL):
+    '''
+    Returns the shared cache selected by url, or None when it is disabled
+
+            Parameters:
+                    url (str): sqlite:///path, redis://host:port/db or none
+
+            Returns:
+                    shared (SharedCache): the shared cache, or None
+    '''
+    if not url or url.lower() == 'none':
+        return None
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            return SharedCache(RedisBackend(url))
+        except ImportError:
+            print ('The redis package is not installed, the shared cache uses SQLite')
+            return SharedCache(SQLiteBackend(DATABASE))
+    if url.startswith('sqlite:///'):
+        return SharedCache(SQLiteBackend(url[len('sqlite:///'):]))
+    raise ValueError('Unknown shared cache: ' + url)
@@ -0,0 +1,210 @@
+'''
+Persistent store of the fundamentals (Finviz metrics, yfinance info and statements).
+
+Usage: python store.py refresh [--every SECONDS]
+       python store.py add TICKER [TICKER ...]
+'''
+import argparse
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from datetime import date
+
+import yfinance as yf
+
+import financials as fin
+import upstream
+
+#folder of the local data (fundamentals.db and prices/), next to the code unless TDLOG_DATA is set
+DATA_DIRECTORY = os.environ.get('TDLOG_DATA', os.path.dirname(os.path.abspath(__file__)))
+DATABASE = os.path.join(DATA_DIRECTORY, 'fundamentals.db')
+
+#age (in seconds) after which the stored data is downloaded again
+MAX_AGE = {'finviz': 24*3600,
+           'info': 7*24*3600,
+           'cashflow': 30*24*3600,
+           'balancesheet': 30*24*3600
+           }
+
+#functions downloading each kind of data for a ticker
+UPSTREAM = {'finviz': fin.get_finviz_data,
+            'info': lambda ticker: upstream.client.run('yahoo', lambda: yf.Ticker(ticker).info),
+            'cashflow': lambda ticker: upstream.client.run('yahoo', lambda: yf.Ticker(ticker).cashflow),
+            'balancesheet': lambda ticker: upstream.client.run('yahoo', lambda: yf.Ticker(ticker).balancesheet)
+            }
+
+def is_empty(value):
+    '''
+    Returns True for the values that mean the download failed (None, empty dict or DataFrame)
+    '''
+    return value is None or len(value) == 0
+
+
+class FundamentalsStore:
+    '''
+    SQLite table of the downloaded data, keyed by ticker, kind of data and as-of date
+
+            Parameters:
+                    path (str): the SQLite file
+                    max_age (dict): age in seconds after which each kind of data is stale
+    '''
+
+    def __init__(self, path=DATABASE, max_age=MAX_AGE):
+        self.path = path
+        self.max_age = dict(max_age)
+        self._local = threading.local()
+        with self.connection() as connection:
+            connection.execute('''CREATE TABLE IF NOT EXISTS fundamentals (
+                                      ticker TEXT NOT NULL,
+                                      kind TEXT NOT NULL,
+                                      as_of TEXT NOT NULL,
+                                      fetched_at REAL NOT NULL,
+                                      payload BLOB NOT NULL,
+                                      PRIMARY KEY (ticker, kind, as_of))''')
+            connection.execute('CREATE TABLE IF NOT EXISTS views (ticker TEXT PRIMARY KEY, count INTEGER NOT NULL)')
+
+    def connection(self):
+        '''
+        Returns the connection of the current thread (sqlite connections cannot be shared between threads)
+        '''
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def load(self, kind, ticker):
+        '''
+        Returns the last stored value of a ticker and the time it was downloaded
+
+            Parameters:
+                    kind (str): kind of data ('finviz', 'info', 'cashflow' or 'balancesheet')
+                    ticker (str): the company ticker
+
+            Returns:
+                    value (object): the stored value, or None
+                    fetched_at (float): time of the download (seconds since the epoch), or None
+        '''
+        row = self.connection().execute('''SELECT payload, fetched_at FROM fundamentals
+                                           WHERE ticker = ? AND kind = ? ORDER BY as_of DESC LIMIT 1''',
+                                        (ticker.upper(), kind)).fetchone()
+        if row is None:
+            return None, None
+        return pickle.loads(row[0]), row[1]
+
+    def as_of(self, ticker):
+        '''
+        Returns the time of the last download of any data of a ticker, or None
+        '''
+        return self.connection().execute('SELECT MAX(fetched_at) FROM fundamentals WHERE ticker = ?',
+                                         (ticker.upper(),)).fetchone()[0]
+
+    def save(self, kind, ticker, value):
+        '''
+        Stores a value as the one of today for a ticker
+        '''
+        with self.connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO fundamentals VALUES (?, ?, ?, ?, ?)',
+                               (ticker.upper(), kind, date.today().isoformat(), time.time(),
+                                pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    def fetch(self, kind, ticker, loader=None):
+        '''
+        Returns the stored value if it is fresh, otherwise downloads it and stores it
+
+            Parameters:
+                    kind (str): kind of data
+                    ticker (str): the company ticker
+                    loader (function): downloads the value, UPSTREAM[kind](ticker) by default
+
+            Returns:
+                    value (object): the fresh value, or the stale one if the download failed
+        '''
+        value, fetched_at = self.load(kind, ticker)
+        if value is not None and time.time() - fetched_at < self.max_age[kind]:
+            return value
+        try:
+            fresh = loader() if loader is not None else UPSTREAM[kind](ticker)
+        except Exception as e:
+            if value is None:
+                raise
+            print ('Serving stale ' + kind + ' of ' + ticker + ': ' + repr(e))
+            return value
+        if is_empty(fresh):
+            return value if value is not None else fresh
+        self.save(kind, ticker, fresh)
+        return fresh
+
+    def add_view(self, ticker):
+        '''
+        Counts a view of a ticker page, in the table shared by all the workers
+        '''
+        with self.connection() as connection:
+            connection.execute('INSERT INTO views VALUES (?, 1) ON CONFLICT (ticker) DO UPDATE SET count = count + 1',
+                               (ticker.upper(),))
+
+    def most_viewed(self, n):
+        '''
+        Returns the n tickers with the most views, the most viewed first
+        '''
+        rows = self.connection().execute('SELECT ticker FROM views ORDER BY count DESC, ticker LIMIT ?', (n,))
+        return [ticker for ticker, in rows]
+
+    def stale(self):
+        '''
+        Returns the (kind, ticker) pairs whose last stored value is older than its maximum age
+        '''
+        now = time.time()
+        rows = self.connection().execute('SELECT ticker, kind, MAX(fetched_at) FROM fundamentals GROUP BY ticker, kind')
+        return [(kind, ticker) for ticker, kind, fetched_at in rows
+                if kind in self.max_age and now - fetched_at >= self.max_age[kind]]
+
+    def refresh(self):
+        '''
+        Downloads again only the stale data
+
+            Returns:
+                    refreshed (int): number of values downloaded
+        '''
+        refreshed = 0
+        for kind, ticker in self.stale():
+            try:
+                value = UPSTREAM[kind](ticker)
+            except Exception as e:
+                print ('Could not refresh ' + kind + ' of ' + ticker + ': ' + repr(e))
+                continue
+            if not is_empty(value):
+                self.save(kind, ticker, value)
+                refreshed += 1
+        return refreshed
+
+
+store = FundamentalsStore()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Persistent store of the fundamentals")
+    commands = parser.add_subparsers(dest='command', required=True)
+    refresh = commands.add_parser('refresh', help="download again the stale data")
+    refresh.add_argument('--every', type=float, help="repeat the refresh every EVERY seconds")
+    add = commands.add_parser('add', help="download and store the data of new tickers")
+    add.add_argument('tickers', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'add':
+        for ticker in args.tickers:
+            for kind in UPSTREAM:
+                store.fetch(kind, ticker)
+    else:
+        while True:
+            print('%d values refreshed' % store.refresh())
+            if not args.every:
+                break
+            time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+'''
+The tests run offline (the fixtures instead of Yahoo Finance and Finviz) on a new data folder
+'''
+import os
+import sys
+import tempfile
+
+os.environ['TDLOG_DATA'] = tempfile.mkdtemp(prefix='tdlog-tests-')
+os.environ['TDLOG_OFFLINE'] = '1'
+os.environ['TDLOG_OFFLINE_LATENCY'] = '0'
+os.environ['TDLOG_PREFETCH'] = '0'
+os.environ['TDLOG_BCRYPT_ROUNDS'] = '4'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+
+
+@pytest.fixture
+def client():
+    import app
+    app.app.config['TESTING'] = True
+    app.init_db()
+    return app.app.test_client()
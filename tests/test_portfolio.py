@@ -0,0 +1,16 @@
+import cache
+import portfolio
+
+
+def test_fair_values_without_growth(client, monkeypatch):
+    get_finviz_data = cache.get_finviz_data
+    def finviz(ticker):
+        data = dict(get_finviz_data(ticker))
+        if ticker == 'KO':
+            data['EPS next 5Y'] = '-'
+        return data
+    monkeypatch.setattr(cache, 'get_finviz_data', finviz)
+
+    values = portfolio.fair_values(['MSFT', 'KO'])
+    assert values['KO'] == "nan"
+    assert isinstance(values['MSFT'], float)
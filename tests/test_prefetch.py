@@ -0,0 +1,13 @@
+import prefetch
+import store
+
+
+def test_most_viewed_across_workers(client):
+    # another worker: its own connection to the same file
+    worker = store.FundamentalsStore(store.DATABASE)
+    prefetch.record_view('msft')
+    worker.add_view('KO')
+    worker.add_view('KO')
+    prefetch.record_view('KO')
+    assert prefetch.most_viewed(2) == ['KO', 'MSFT']
+    assert worker.most_viewed(1) == ['KO']
@@ -0,0 +1,21 @@
+import cache
+import screener
+
+
+def test_screener_requires_login(client):
+    response = client.post('/screener', data={'tickers': 'AAPL'})
+    assert response.status_code == 302 and '/login' in response.headers['Location']
+
+
+def test_fetch_uses_the_cache(client, monkeypatch):
+    tickers = []
+    get_finviz_data = cache.get_finviz_data
+    def finviz(ticker):
+        tickers.append(ticker)
+        return get_finviz_data(ticker)
+    monkeypatch.setattr(cache, 'get_finviz_data', finviz)
+
+    ticker, metrics, statements, error = screener.fetch('KO')
+    assert error is None and tickers == ['KO']
+    [row] = screener.value_chunk([(ticker, metrics, statements, error)])
+    assert row['ticker'] == 'KO' and row['name'] and row['fair_value'] is not None
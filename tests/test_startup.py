@@ -0,0 +1,35 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+#budget (in seconds) of the median time of "import app" in a new process, like a new worker
+IMPORT_BUDGET = float(os.environ.get('TDLOG_IMPORT_BUDGET', 1))
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+print(json.dumps({'seconds': time.perf_counter() - start,
+                  'modules': [m for m in ('numpy', 'pandas', 'yfinance', 'lxml') if m in sys.modules]}))
+'''
+
+
+def probe():
+    environment = dict(os.environ, TDLOG_DATA=tempfile.mkdtemp(prefix='tdlog-tests-'), TDLOG_PREFETCH='0')
+    environment.pop('TDLOG_OFFLINE', None)
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=environment,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_import_app_under_budget():
+    runs = [probe() for _ in range(3)]
+    # the heavy modules are imported by the functions which need them
+    assert runs[0]['modules'] == []
+    median = statistics.median(run['seconds'] for run in runs)
+    assert median < IMPORT_BUDGET, 'import app takes %.3f s, above the budget of %.3f s' % (median, IMPORT_BUDGET)
@@ -0,0 +1,41 @@
+import json
+
+import app
+import cache
+import live
+
+
+def test_stream_without_beta(client, monkeypatch):
+    get_finviz_data = cache.get_finviz_data
+    monkeypatch.setattr(cache, 'get_finviz_data', lambda ticker: dict(get_finviz_data(ticker), Beta='-'))
+    monkeypatch.setattr(app, 'LIVE_KEEPALIVE', 0.05)
+    # a stopped poller does not download the quotes, the test publishes them
+    poller = live.Poller()
+    poller.stopped.set()
+    monkeypatch.setattr(live, 'poller', poller)
+
+    valuation = client.get('/api/ticker/AAPL/valuation').get_json()
+    assert valuation['price'] == "nan" and valuation['recommendation'] == "nan"
+
+    response = client.get('/api/ticker/AAPL/stream', buffered=False)
+    chunks = response.response
+    assert next(chunks).startswith(b': keepalive')
+    poller.publish('AAPL', ('2024-01-02', 190.0))
+    chunk = next(chunk for chunk in chunks if chunk.startswith(b'data: '))
+    event = json.loads(chunk[len(b'data: '):])
+    assert event == {'ticker': 'AAPL', 'date': '2024-01-02', 'last_close': 190.0,
+                     'price': "nan", 'recommendation': "nan"}
+    response.close()
+    assert not poller.subscribers
+
+
+def test_stream_closed_before_the_first_event(client, monkeypatch):
+    poller = live.Poller()
+    poller.stopped.set()
+    monkeypatch.setattr(live, 'poller', poller)
+
+    # the server closes the response without iterating it when the client is already gone
+    with app.app.test_request_context('/api/ticker/AAPL/stream'):
+        response = app.app.view_functions['api_stream']('AAPL')
+    response.close()
+    assert not poller.subscribers
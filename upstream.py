@@ -0,0 +1,212 @@
+'''
+Asynchronous client of the upstreams (Finviz, Yahoo Finance and financialmodelingprep), shared by the web routes,
+the background threads and the screener: the calls to each host are limited by a semaphore,
+timed out, retried with jittered backoff and cut by a circuit breaker while the host is failing,
+so that the callers serve their stale cached data instead of waiting.
+
+The downloads themselves (requests session, yfinance) are blocking: they run in the threads
+of the client, on an asyncio loop which owns the limits and the retries.
+'''
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from metrics import registry
+
+try:
+    from yfinance.exceptions import YFRateLimitError
+except ImportError:
+    YFRateLimitError = ()
+
+#maximum number of concurrent calls to each host
+LIMITS = {'finviz': 8,
+          'yahoo': 8,
+          'fmp': 4
+          }
+#maximum wait (in seconds) for one call to each host
+TIMEOUTS = {'finviz': 10,
+            'yahoo': 20,
+            'fmp': 10
+            }
+#retries of a failed call, after a backoff of BACKOFF*2**attempt seconds, +/- 50% of jitter
+RETRIES = 2
+BACKOFF = 0.5
+#consecutive failures opening the circuit of a host, and seconds before a new trial call
+FAILURES = 5
+RESET = 30
+
+
+class CircuitOpen(IOError):
+    '''
+    Raised without calling the host while its circuit is open
+    '''
+
+
+class CircuitBreaker:
+    '''
+    Opens after a number of consecutive failures; after reset seconds one trial call is let through
+    (half-open), which closes the circuit if it succeeds
+
+            Parameters:
+                    failures (int): consecutive failures opening the circuit
+                    reset (float): seconds before the trial call
+    '''
+
+    def __init__(self, failures=FAILURES, reset=RESET):
+        self.failures = failures
+        self.reset = reset
+        self.count = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self.trial and time.monotonic() - self.opened_at >= self.reset:
+                self.trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.count = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        with self._lock:
+            self.count += 1
+            if self.trial or self.count >= self.failures:
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+
+def retryable(error):
+    '''
+    Returns True for the errors of an unavailable host (network errors, timeouts, HTTP 429 and 5xx,
+    rate limiting), which a new try may fix; the other errors (unknown ticker, parsing) are not retried
+    and do not count as failures of the host
+    '''
+    if isinstance(error, CircuitOpen):
+        return False
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, (OSError, YFRateLimitError))
+
+
+class UpstreamClient:
+    '''
+    Runs the upstream calls on an asyncio loop (in a daemon thread, started by the first call)
+
+            Parameters:
+                    limits (dict): maximum number of concurrent calls to each host
+                    timeouts (dict): maximum wait in seconds for one call to each host
+                    retries (int): retries of a failed call
+                    backoff (float): base of the exponential backoff in seconds
+    '''
+
+    def __init__(self, limits=LIMITS, timeouts=TIMEOUTS, retries=RETRIES, backoff=BACKOFF):
+        self.limits = dict(limits)
+        self.timeouts = dict(timeouts)
+        self.retries = retries
+        self.backoff = backoff
+        self.breakers = {host: CircuitBreaker() for host in self.limits}
+        self.executor = ThreadPoolExecutor(max_workers=sum(self.limits.values()), thread_name_prefix='upstream')
+        self._semaphores = {}
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def loop(self):
+        '''
+        Returns the event loop of the client, running in its own thread
+        '''
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='upstream-loop', daemon=True).start()
+            return self._loop
+
+    async def _attempt(self, host, fn, args):
+        '''
+        Runs one call in a thread; the semaphore is released when the thread is done, even after a timeout
+        '''
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._semaphores[host] = asyncio.Semaphore(self.limits[host])
+        await semaphore.acquire()
+        future = asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        def done(future):
+            semaphore.release()
+            if not future.cancelled():
+                future.exception()
+        future.add_done_callback(done)
+        return await asyncio.wait_for(asyncio.shield(future), self.timeouts[host])
+
+    async def call(self, host, fn, *args):
+        '''
+        Calls fn(*args) for a host with its concurrency limit, timeout, retries and circuit breaker
+
+            Parameters:
+                    host (str): 'finviz', 'yahoo' or 'fmp'
+                    fn (function): the blocking download
+
+            Returns:
+                    result (object): what fn returned, CircuitOpen is raised while the circuit is open
+        '''
+        breaker = self.breakers[host]
+        for attempt in range(self.retries + 1):
+            if not breaker.allow():
+                registry.inc('tdlog_circuit_rejected_total', (('host', host),))
+                raise CircuitOpen(host + ' is unavailable')
+            try:
+                result = await self._attempt(host, fn, args)
+            except Exception as e:
+                if not retryable(e):
+                    breaker.success()
+                    raise
+                breaker.failure()
+                if attempt == self.retries:
+                    raise
+                registry.inc('tdlog_upstream_retries_total', (('host', host),))
+                await asyncio.sleep(self.backoff*2**attempt*random.uniform(0.5, 1.5))
+            else:
+                breaker.success()
+                return result
+
+    async def gather(self, host, fn, items):
+        '''
+        Calls fn(item) for all the items concurrently, returning the results or the exceptions in order
+        '''
+        return await asyncio.gather(*(self.call(host, fn, item) for item in items), return_exceptions=True)
+
+    def run(self, host, fn, *args):
+        '''
+        Same as call, for the synchronous callers: waits for the result in the calling thread
+        '''
+        return asyncio.run_coroutine_threadsafe(self.call(host, fn, *args), self.loop()).result()
+
+    def map(self, host, fn, items):
+        '''
+        Same as gather, for the synchronous callers
+        '''
+        return asyncio.run_coroutine_threadsafe(self.gather(host, fn, list(items)), self.loop()).result()
+
+    def states(self):
+        '''
+        Returns the hosts whose circuit is open (1) or closed (0)
+        '''
+        return {host: int(breaker.is_open) for host, breaker in self.breakers.items()}
+
+
+client = UpstreamClient()
@@ -0,0 +1,229 @@
+'''
+Compact index of the known tickers, built from the batch valuations of the screener: sorted
+numpy arrays of symbol, name, last price, fair value and margin of safety. It answers the
+prefix autocompletion of the search boxes, accepts the known tickers without any upstream call
+and ranks the most undervalued companies, from memory. The tickers missing from it are checked
+on Finviz and Yahoo Finance.
+
+Usage: python valuation_index.py build TICKERS_FILE [--workers N]
+'''
+import argparse
+import os
+import re
+import sys
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: only the development server, in one process
+    fcntl = None
+
+#same folder as store.DATA_DIRECTORY, without importing yfinance
+PATH = os.path.join(os.environ.get('TDLOG_DATA', os.path.dirname(os.path.abspath(__file__))), 'valuation_index.npz')
+
+#what a ticker can look like: letters and digits, the separators of the share classes, ^ of the indices, =X of the currencies
+TICKER = re.compile(r'\^?[A-Z0-9][A-Z0-9.\-=]{0,11}')
+
+COLUMNS = ('symbols', 'names', 'prices', 'fair_values', 'margins')
+
+
+def is_finite(number):
+    return isinstance(number, (int, float)) and bool(np.isfinite(number))
+
+
+class ValuationIndex:
+    '''
+    Immutable arrays sorted by symbol, and the positions of the companies by decreasing margin of safety
+
+            Parameters:
+                    symbols (array): the tickers (ASCII)
+                    names (array): the company names
+                    prices, fair_values, margins (arrays): the last valuation, NaN when unknown
+    '''
+
+    def __init__(self, symbols=(), names=(), prices=(), fair_values=(), margins=()):
+        symbols = np.asarray(symbols, dtype='S')
+        order = np.argsort(symbols, kind='stable')
+        self.symbols = symbols[order]
+        self.names = np.asarray(names, dtype='U')[order]
+        self.prices = np.asarray(prices, dtype=np.float32)[order]
+        self.fair_values = np.asarray(fair_values, dtype=np.float32)[order]
+        self.margins = np.asarray(margins, dtype=np.float32)[order]
+        # NaN margins are last
+        self.ranking = np.argsort(np.where(np.isnan(self.margins), np.inf, -self.margins), kind='stable')
+        self.valued = int(np.count_nonzero(~np.isnan(self.margins)))
+
+    def __len__(self):
+        return len(self.symbols)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, column).nbytes for column in COLUMNS) + self.ranking.nbytes
+
+    def __contains__(self, symbol):
+        key = symbol.upper().encode('ascii', 'ignore')
+        i = np.searchsorted(self.symbols, key)
+        return i < len(self.symbols) and self.symbols[i] == key
+
+    def row(self, i):
+        return {'ticker': self.symbols[i].decode('ascii'),
+                'name': str(self.names[i]),
+                'price': None if np.isnan(self.prices[i]) else round(float(self.prices[i]), 2),
+                'fair_value': None if np.isnan(self.fair_values[i]) else round(float(self.fair_values[i]), 2),
+                'margin': None if np.isnan(self.margins[i]) else round(float(self.margins[i]), 2)}
+
+    def complete(self, prefix, limit=10):
+        '''
+        Returns the companies whose ticker starts with a prefix, in alphabetical order
+
+            Parameters:
+                    prefix (str): the beginning of the ticker
+                    limit (int): maximum number of companies
+
+            Returns:
+                    rows (list): dicts with ticker, name, price, fair_value and margin
+        '''
+        key = prefix.strip().upper().encode('ascii', 'ignore')
+        if not key:
+            return []
+        start = np.searchsorted(self.symbols, key, side='left')
+        end = np.searchsorted(self.symbols, key + b'\xff', side='left')
+        return [self.row(i) for i in range(start, min(end, start + limit))]
+
+    def top(self, n=20):
+        '''
+        Returns the n valued companies with the largest margin of safety
+        '''
+        return [self.row(i) for i in self.ranking[:min(n, self.valued)]]
+
+    def merged(self, rows):
+        '''
+        Returns a new index with the valuations of rows (dicts of the screener) added or replaced; the errors
+        and the rows without a finite margin of safety are left out
+        '''
+        rows = [row for row in rows if 'error' not in row and TICKER.fullmatch(row['ticker']) and is_finite(row.get('margin'))]
+        new = {row['ticker'].encode('ascii') for row in rows}
+        keep = np.array([symbol not in new for symbol in self.symbols], dtype=bool)
+        return ValuationIndex(np.concatenate([self.symbols[keep], np.array([row['ticker'] for row in rows], dtype='S')]),
+                              np.concatenate([self.names[keep], np.array([row.get('name', '') for row in rows], dtype='U')]),
+                              np.concatenate([self.prices[keep], [row['price'] for row in rows]]),
+                              np.concatenate([self.fair_values[keep], [row['fair_value'] for row in rows]]),
+                              np.concatenate([self.margins[keep], [row['margin'] for row in rows]]))
+
+    def save(self, path=PATH):
+        # written next to the index then renamed, so that the other processes never read half of it
+        temporary = '%s.%d.tmp.npz' % (path, os.getpid())
+        np.savez(temporary, **{column: getattr(self, column) for column in COLUMNS})
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path=PATH):
+        '''
+        Returns the saved index, or an empty one
+        '''
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path) as arrays:
+            return cls(*(arrays[column] for column in COLUMNS))
+
+
+_index = None
+_mtime = None
+_lock = threading.Lock()
+
+def modified(path):
+    # a saved index is a new file: its inode changes even when two saves happen in the same second
+    try:
+        status = os.stat(path)
+        return status.st_ino, status.st_mtime_ns
+    except OSError:
+        return None
+
+@contextmanager
+def locked(path):
+    '''
+    Holds the lock file of the index, so that only one worker process updates it at a time
+    '''
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def index(path=PATH):
+    '''
+    Returns the current index, loaded again from path when another process saved a new one
+    '''
+    global _index, _mtime
+    mtime = modified(path)
+    if _index is None or mtime != _mtime:
+        with _lock:
+            if _index is None or mtime != _mtime:
+                _index, _mtime = ValuationIndex.load(path), mtime
+    return _index
+
+def update(rows, path=PATH):
+    '''
+    Adds the valuations of the screener to the index and saves it (the readers keep the previous arrays)
+    '''
+    global _index, _mtime
+    with _lock, locked(path):
+        # read again under the lock: another worker may have saved its rows since
+        current = ValuationIndex.load(path)
+        _index = current.merged(rows)
+        _index.save(path)
+        _mtime = modified(path)
+    return _index
+
+def exists(symbol):
+    '''
+    Returns True if Finviz or Yahoo Finance has data about a ticker, the answer being kept in the cache
+    '''
+    import cache
+    def check():
+        if cache.get_finviz_data(symbol):
+            return True
+        history = cache.CachedTicker(symbol).history(period='5d')
+        return history is not None and not history.empty
+    return cache.ticker_cache.get('exists', symbol, check)
+
+def is_valid(symbol):
+    '''
+    Returns False for the strings which cannot be a ticker, and for the tickers unknown to the index,
+    Finviz and Yahoo Finance; a ticker is accepted when the upstream cannot be checked
+    '''
+    symbol = symbol.strip().upper()
+    if not TICKER.fullmatch(symbol):
+        return False
+    if symbol in index():
+        return True
+    try:
+        return exists(symbol)
+    except Exception as e:
+        print ('Could not check ' + symbol + ': ' + repr(e))
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Builds the valuation index from a list of tickers")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="values the tickers and adds them to the index")
+    build.add_argument('tickers', help="file with the tickers, '-' for the standard input")
+    build.add_argument('--workers', type=int, help="number of concurrent downloads")
+    args = parser.parse_args(argv)
+
+    import screener
+    text = sys.stdin.read() if args.tickers == '-' else open(args.tickers).read()
+    tickers = screener.read_tickers(text)
+    rows = [row for rows in screener.screen(tickers, args.workers or screener.FETCH_WORKERS) for row in rows]
+    current = update(rows)
+    print('%d tickers in the index (%d valued), %d bytes' % (len(current), current.valued, current.nbytes))
+
+
+if __name__ == "__main__":
+    main()
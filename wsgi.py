@@ -0,0 +1,16 @@
+'''
+Production entry point, served by several worker processes:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The application is imported once by the master (preload) and the workers are forked from it. The
+downloaded data is shared between the workers by the cache of shared_cache.py, and only one worker
+prefetches the favorited and most viewed tickers.
+'''
+from app import app, init_db, sql
+
+#the schema is created once, before the workers are forked
+init_db()
+with app.app_context():
+    # the workers open their own connections
+    sql.engine.dispose()